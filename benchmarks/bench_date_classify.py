@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+## Batch age classification in date_compare
+##
+## Classifies N synthetic GitLab "committed_date" strings as older/newer than the
+## commit age threshold: one date_more_than_x_months_ago() call per string (new cutoff
+## every call), one AgeCutoff.older_than() call per string (one cutoff), then
+## dates_more_than_x_months_ago() on the whole list without and with NumPy (skipped
+## when it is not installed).  All must produce the same mask.
+##
+##   python benchmarks/bench_date_classify.py --dates 1000000 --months 3
+import argparse
+import datetime
+import json
+import pathlib
+import random
+import sys
+import time
+
+BENCHMARK_DIR       = pathlib.Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARK_DIR.parent))
+import date_compare
+
+def committed_dates(num_dates, months, seed):
+    ## GitLab REST format, spread over the last two years, a few non-UTC offsets; none
+    ## within an hour of the cutoff, so the masks agree even though "now" moves on
+    ## between the runs
+    rng = random.Random(seed)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cutoff = date_compare.datetime_x_months_ago(months)
+    offsets = [datetime.timezone.utc, datetime.timezone(datetime.timedelta(hours=-5)), datetime.timezone(datetime.timedelta(hours=5, minutes=30))]
+    dt_strings = []
+    while len(dt_strings) < num_dates:
+        dt_object = now - datetime.timedelta(seconds=rng.randint(0, 2 * 365 * 86400))
+        if abs((dt_object - cutoff).total_seconds()) < 3600:
+            continue
+        dt_strings.append(dt_object.astimezone(rng.choice(offsets)).isoformat(timespec="milliseconds"))
+    return dt_strings
+
+def timed(function):
+    started = time.perf_counter()
+    result = function()
+    return time.perf_counter() - started, [bool(each_value) for each_value in result]
+
+def run_benchmarks(args):
+    dt_strings = committed_dates(args.dates, args.months, args.seed)
+    age_cutoff = date_compare.AgeCutoff(args.months)
+    methods = [
+        ("batch (python)", lambda: date_compare.dates_more_than_x_months_ago(dt_strings, args.months, use_numpy=False)),
+        ("per call", lambda: [date_compare.date_more_than_x_months_ago(dt_string, args.months) for dt_string in dt_strings[:args.per_call_dates]]),
+        ("AgeCutoff", lambda: [age_cutoff.older_than(dt_string) for dt_string in dt_strings]),
+    ]
+    if date_compare.load_numpy() is not None:
+        methods.append(("batch (numpy)", lambda: date_compare.dates_more_than_x_months_ago(dt_strings, args.months)))
+    results = []
+    reference_mask = None
+    for name, function in methods:
+        seconds, mask = timed(function)
+        num_dates = len(mask)
+        ## (the per-call run covers a prefix of the dates)
+        if reference_mask is None:
+            reference_mask = mask
+        assert mask == reference_mask[:num_dates], name
+        results.append({
+            "method": name,
+            "dates": num_dates,
+            "stale": sum(mask),
+            "seconds": round(seconds, 4),
+            "ns_per_date": round(seconds / max(num_dates, 1) * 1e9, 1),
+            "seconds_per_million": round(seconds / max(num_dates, 1) * 1e6, 3),
+        })
+    return results
+
+def print_results(results):
+    print("%-16s %10s %10s %10s %12s %12s" % ("method", "dates", "stale", "time (s)", "ns/date", "s per 1M"))
+    for each_result in results:
+        print("%-16s %10d %10d %10.3f %12.1f %12.3f" % (
+            each_result["method"], each_result["dates"], each_result["stale"], each_result["seconds"],
+            each_result["ns_per_date"], each_result["seconds_per_million"]))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark per-call vs batch commit date classification")
+    parser.add_argument("--dates", type=int, default=1000000, help="number of commit dates (default: 1000000)")
+    parser.add_argument("--per-call-dates", type=int, default=100000, help="dates classified one call at a time (default: 100000; slow)")
+    parser.add_argument("--months", type=int, default=3, help="commit age threshold in months (default: 3)")
+    parser.add_argument("--seed", type=int, default=1, help="random seed (default: 1)")
+    parser.add_argument("--json", type=str, help="also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args)
+    print_results(results)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+## Microbenchmarks for date_compare, checked against stored baselines
+##
+## Cases: read_date_string_to_dtz on a sample of every format in dt_string_formats
+## (parse cache disabled, so each call parses) and once answered from the cache,
+## on strings that match no format (every candidate format is tried), and the
+## date_more_than_* helpers plus the batch dates_more_than_x_months_ago (pure Python
+## and NumPy when installed) on batches of distinct GitLab committed_date strings,
+## 1 to 1M.  Each batch starts with an empty parse cache.  For every case it reports
+## ns/op (best of the repeats) and the tracemalloc peak in bytes per op (memory held
+## at the peak of one separate run, not a count of allocations).  --update-baseline
+## stores the results as the baseline; otherwise the run fails (exit status 1) when
+## there is no baseline, or when a case's ns/op is more than --threshold slower than
+## its baseline.  Baselines only compare within one machine and Python version, so
+## they are not committed: record one first.
+##
+##   python benchmarks/bench_date_compare.py --update-baseline
+##   python benchmarks/bench_date_compare.py --threshold 0.2
+import argparse
+import datetime
+import json
+import pathlib
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+BENCHMARK_DIR       = pathlib.Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARK_DIR.parent))
+import date_compare
+
+DEFAULT_BASELINE    = BENCHMARK_DIR / "baselines" / "bench_date_compare.json"
+DEFAULT_THRESHOLD   = 0.2
+DEFAULT_BATCH_SIZES = [1, 100, 10000, 1000000]
+SAMPLE_DATE         = datetime.datetime(2025, 11, 23, 22, 34, 31, 123000, tzinfo=datetime.timezone.utc)
+## every candidate format fails on these (digit first: the ISO formats; letter
+## first: the weekday-name formats)
+UNREADABLE_STRINGS  = {
+    "iso-like, trailing text":  "2025-11-23T22:34:31.000+00:00 extra",
+    "iso-like, bad month":      "2025-13-23 22:34:31",
+    "weekday, bad year":        "Mon Jan 05 10:00:00 20x4 +0000",
+    "no date at all":           "not a date",
+}
+
+def format_samples():
+    ## {format: a string in that format}; %Z formats get "UTC", naive formats no offset
+    samples = {}
+    for each_format in date_compare.dt_string_formats:
+        if "%z" in each_format or "%Z" in each_format:
+            samples[each_format] = SAMPLE_DATE.strftime(each_format)
+        else:
+            samples[each_format] = SAMPLE_DATE.replace(tzinfo=None).strftime(each_format)
+    return samples
+
+def committed_dates(num_dates, seed):
+    ## distinct GitLab REST committed_date strings over the last two years
+    rng = random.Random(seed)
+    now = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+    seconds_ago = rng.sample(range(2 * 365 * 86400), num_dates)
+    return [(now - datetime.timedelta(seconds=each_seconds)).isoformat(timespec="milliseconds") for each_seconds in seconds_ago]
+
+def single_call_case(function, dt_string, cached=False):
+    ## one op: one call; without the cache every call parses
+    def run(number):
+        maxsize = date_compare.parse_cache.maxsize
+        date_compare.parse_cache.maxsize = maxsize if cached else 0
+        date_compare.clear_parse_cache()
+        try:
+            started = time.perf_counter()
+            for _ in range(number):
+                function(dt_string)
+            return time.perf_counter() - started
+        finally:
+            date_compare.parse_cache.maxsize = maxsize
+            date_compare.clear_parse_cache()
+    return run, 1
+
+def batch_case(function, dt_strings, per_call=True):
+    ## one op: one date of the batch; the cache is emptied before every pass
+    def run(number):
+        elapsed = 0.0
+        for _ in range(number):
+            date_compare.clear_parse_cache()
+            started = time.perf_counter()
+            if per_call:
+                for dt_string in dt_strings:
+                    function(dt_string)
+            else:
+                function(dt_strings)
+            elapsed += time.perf_counter() - started
+        date_compare.clear_parse_cache()
+        return elapsed
+    return run, len(dt_strings)
+
+def cases(args):
+    ## [(name, run(number) -> seconds, ops per run)]
+    result = []
+    for each_format, dt_string in format_samples().items():
+        result.append(("read %s" % (each_format),) + single_call_case(date_compare.read_date_string_to_dtz, dt_string))
+    result.append(("read cached %s" % (date_compare.dt_string_formats[0]),) + single_call_case(
+        date_compare.read_date_string_to_dtz, SAMPLE_DATE.isoformat(timespec="milliseconds"), cached=True))
+    for name, dt_string in UNREADABLE_STRINGS.items():
+        result.append(("unreadable %s" % (name),) + single_call_case(date_compare.read_date_string_to_dtz, dt_string))
+    all_dates = committed_dates(max(args.batch_sizes), args.seed)
+    helpers = [
+        ("date_more_than_one_month_ago", date_compare.date_more_than_one_month_ago, True),
+        ("date_more_than_six_months_ago", date_compare.date_more_than_six_months_ago, True),
+        ("date_more_than_x_months_ago", date_compare.date_more_than_x_months_ago, True),
+        ("dates_more_than_x_months_ago (python)", lambda dt_strings: date_compare.dates_more_than_x_months_ago(dt_strings, use_numpy=False), False),
+    ]
+    if date_compare.load_numpy() is not None:
+        helpers.append(("dates_more_than_x_months_ago (numpy)", date_compare.dates_more_than_x_months_ago, False))
+    for batch_size in args.batch_sizes:
+        dt_strings = all_dates[:batch_size]
+        for name, function, per_call in helpers:
+            result.append(("%s x%d" % (name, batch_size),) + batch_case(function, dt_strings, per_call))
+    return result
+
+def calibrate(run, min_seconds):
+    ## (runs per repeat, so that a repeat takes at least min_seconds; time of the last
+    ## of them, which counts as the first repeat)
+    number = 1
+    while True:
+        elapsed = run(number)
+        if elapsed >= min_seconds:
+            return number, elapsed
+        number = max(number * 2, int(number * min_seconds / max(elapsed, 1e-9) * 1.2))
+
+def peak_bytes(run):
+    ## tracemalloc peak of one run: bytes allocated and still held at the peak
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        start_bytes, _ = tracemalloc.get_traced_memory()
+        run(1)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return max(peak - start_bytes, 0)
+
+def run_benchmarks(args):
+    results = []
+    for name, run, ops in cases(args):
+        number, first_seconds = calibrate(run, args.min_seconds)
+        ## (long cases stop repeating after --max-seconds)
+        samples = [first_seconds]
+        while len(samples) < args.repeat and sum(samples) < args.max_seconds:
+            samples.append(run(number))
+        best_seconds = min(samples)
+        results.append({
+            "case": name,
+            "ops": ops * number,
+            "ns_per_op": round(best_seconds / (ops * number) * 1e9, 1),
+            "peak_bytes_per_op": round(peak_bytes(run) / ops, 1),
+        })
+        if args.verbose:
+            print("%-60s %12.1f ns/op" % (name, results[-1]["ns_per_op"]), file=sys.stderr)
+    return results
+
+def read_baseline(fname):
+    try:
+        with open(fname, "r") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+def write_baseline(fname, results):
+    fname.parent.mkdir(parents=True, exist_ok=True)
+    with open(fname, "w") as file:
+        json.dump({
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cases": {each_result["case"]: {
+                "ns_per_op": each_result["ns_per_op"],
+                "peak_bytes_per_op": each_result["peak_bytes_per_op"],
+            } for each_result in results},
+        }, file, indent=2)
+
+def compare(results, baseline, threshold):
+    ## adds baseline/change/ok to each result; cases without a baseline pass
+    baseline_cases = baseline["cases"] if baseline else {}
+    for each_result in results:
+        baseline_result = baseline_cases.get(each_result["case"])
+        if baseline_result is None:
+            each_result.update(baseline_ns_per_op=None, change=None, ok=True)
+            continue
+        change = each_result["ns_per_op"] / baseline_result["ns_per_op"] - 1
+        each_result.update(baseline_ns_per_op=baseline_result["ns_per_op"], change=round(change, 3), ok=change <= threshold)
+    return results
+
+def print_results(results, threshold):
+    print("%-60s %12s %12s %12s %12s  %s" % ("case", "ns/op", "baseline", "change", "peak B/op", "result"))
+    for each_result in results:
+        if each_result["change"] is None:
+            baseline_text, change_text, verdict = "-", "-", "new"
+        else:
+            baseline_text = "%.1f" % (each_result["baseline_ns_per_op"])
+            change_text = "%+.1f%%" % (each_result["change"] * 100)
+            verdict = "ok" if each_result["ok"] else "FAIL: over +%.0f%%" % (threshold * 100)
+        print("%-60s %12.1f %12s %12s %12.0f  %s" % (
+            each_result["case"], each_result["ns_per_op"], baseline_text, change_text,
+            each_result["peak_bytes_per_op"], verdict))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark date_compare and compare with stored baselines")
+    parser.add_argument("--batch-sizes", type=lambda text: [int(each_size) for each_size in text.split(",")], default=DEFAULT_BATCH_SIZES,
+                        help="comma separated batch sizes for the date_more_than_* helpers (default: %s)" % (",".join(str(each_size) for each_size in DEFAULT_BATCH_SIZES)))
+    parser.add_argument("--repeat", type=int, default=5, help="timed repeats per case, the best counts (default: 5)")
+    parser.add_argument("--min-seconds", type=float, default=0.2, help="minimum time of one repeat (default: 0.2)")
+    parser.add_argument("--max-seconds", type=float, default=10, help="no further repeats of a case after this many seconds (default: 10)")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="allowed slowdown over the baseline, as a fraction (default: %s)" % (DEFAULT_THRESHOLD))
+    parser.add_argument("--baseline", type=pathlib.Path, default=DEFAULT_BASELINE, help="baseline file (default: %s)" % (DEFAULT_BASELINE))
+    parser.add_argument("--update-baseline", action="store_true", help="store this run as the baseline instead of comparing")
+    parser.add_argument("--seed", type=int, default=1, help="random seed (default: 1)")
+    parser.add_argument("--json", type=str, help="also write the results as JSON to this file")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print each case as it finishes")
+    args = parser.parse_args()
+
+    ## (checked before the run: a missing baseline would otherwise pass unnoticed)
+    baseline = None
+    if not args.update_baseline:
+        baseline = read_baseline(args.baseline)
+        if baseline is None:
+            print("ERROR: no baseline %r: record one with --update-baseline" % (str(args.baseline)))
+            sys.exit(1)
+    results = run_benchmarks(args)
+    compare(results, baseline, args.threshold)
+    print_results(results, args.threshold)
+    if args.update_baseline:
+        write_baseline(args.baseline, results)
+        print("INFO: baseline written to %r" % (str(args.baseline)))
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+    sys.exit(0 if all(each_result["ok"] for each_result in results) else 1)
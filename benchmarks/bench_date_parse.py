@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+## Per-call cost of date_compare.read_date_string_to_dtz
+##
+## Times the parser on GitLab "committed_date" strings (REST/GraphQL: ISO 8601 with
+## milliseconds and an offset; git-mirror: iso-strict) and on the strptime-only shapes
+## it still accepts, next to the previous implementation (every format from an
+## unordered set until one does not raise).  Both must return the same datetime.
+## "after" is the uncached parser (parse_date_string_to_dtz), "cached" a repeated
+## string answered from the parse cache.
+##
+##   python benchmarks/bench_date_parse.py --number 20000
+import argparse
+import datetime
+import json
+import pathlib
+import sys
+import timeit
+
+BENCHMARK_DIR       = pathlib.Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARK_DIR.parent))
+import date_compare
+
+SAMPLES = {
+    "gitlab committed_date":    "2026-05-19T04:15:15.000+00:00",
+    "gitlab committed_date -05":    "2025-11-23T22:34:31.000-05:00",
+    "git iso-strict":           "2025-11-23T22:34:31+00:00",
+    "utc Z":                    "2025-11-23T22:34:31Z",
+    "date only":                "2024-01-01",
+    "tz name (UTC)":            "2024-01-01 10:00:00UTC",
+    "git default":              "Mon Jan 05 10:00:00 2024 +0000",
+}
+
+## the implementation before the format dispatch, kept here as the baseline
+PREVIOUS_FORMATS = {
+    r"%Y-%m-%d %H:%M:%S.%f%z", r"%Y-%m-%dT%H:%M:%S.%f%z", r"%Y-%m-%d %H:%M:%S.%f%Z", r"%Y-%m-%dT%H:%M:%S.%f%Z",
+    r"%Y-%m-%d %H:%M:%S.%f", r"%Y-%m-%dT%H:%M:%S.%f", r"%Y-%m-%d %H:%M:%S%z", r"%Y-%m-%dT%H:%M:%S%z",
+    r"%Y-%m-%d %H:%M:%S%Z", r"%Y-%m-%dT%H:%M:%S%Z", r"%a %b %d %H:%M:%S %Y %z", r"%a %b %d %H:%M:%S %Z %Y",
+    r"%Y-%m-%d %H:%M:%S", r"%Y-%m-%d %H:%M", r"%Y-%m-%d",
+}
+
+def previous_read_date_string_to_dtz(dt_string):
+    for each_format in PREVIOUS_FORMATS:
+        try:
+            dt_object = datetime.datetime.strptime(dt_string, each_format)
+        except:
+            pass
+        else:
+            return(dt_object.astimezone())
+    return(False)
+
+def per_call_us(function, dt_string, number):
+    ## best of 5 repeats, in microseconds per call
+    return min(timeit.repeat(lambda: function(dt_string), number=number, repeat=5)) / number * 1e6
+
+def run_benchmarks(args):
+    results = []
+    for name, dt_string in SAMPLES.items():
+        assert date_compare.read_date_string_to_dtz(dt_string) == previous_read_date_string_to_dtz(dt_string), dt_string
+        previous_us = per_call_us(previous_read_date_string_to_dtz, dt_string, args.number)
+        current_us = per_call_us(date_compare.parse_date_string_to_dtz, dt_string, args.number)
+        cached_us = per_call_us(date_compare.read_date_string_to_dtz, dt_string, args.number)
+        results.append({
+            "sample": name,
+            "string": dt_string,
+            "previous_us": round(previous_us, 3),
+            "current_us": round(current_us, 3),
+            "cached_us": round(cached_us, 3),
+            "speedup": round(previous_us / current_us, 1),
+        })
+    return results
+
+def print_results(results):
+    print("%-26s %-32s %12s %12s %8s %12s" % ("sample", "string", "before (us)", "after (us)", "speedup", "cached (us)"))
+    for each_result in results:
+        print("%-26s %-32s %12.2f %12.2f %7.1fx %12.2f" % (
+            each_result["sample"], each_result["string"], each_result["previous_us"],
+            each_result["current_us"], each_result["speedup"], each_result["cached_us"]))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark date_compare.read_date_string_to_dtz per call")
+    parser.add_argument("--number", type=int, default=20000, help="calls per timing repeat (default: 20000)")
+    parser.add_argument("--json", type=str, help="also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args)
+    print_results(results)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+## Benchmark of the plan file layouts read/written by query_gitlab.py
+##
+## Generates a synthetic plan, then writes and reads it back in every layout (YAML with
+## the pure-Python and the libyaml classes, JSON, JSONL, SQLite) and reports time, file
+## size and peak memory of each step, plus the time to look up one project's branches.
+## Each step runs in a fresh subprocess so peak memory is that step's own.
+##
+##   python benchmarks/bench_plan_formats.py --projects 1000 --branches 100
+import argparse
+import json
+import os
+import pathlib
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR       = pathlib.Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARK_DIR.parent))
+import yaml
+import gitlab_plan
+
+LAYOUTS             = ["yaml-py", "yaml-c", "json", "jsonl", "sqlite"]
+LAYOUT_EXTENSIONS   = {"yaml-py": "yaml", "yaml-c": "yaml", "json": "json", "jsonl": "jsonl", "sqlite": "sqlite"}
+
+def plan_records(num_projects, num_branches, seed):
+    ## (project, branch, committed_date), sorted by project
+    rng = random.Random(seed)
+    for project_index in range(num_projects):
+        for branch_index in range(num_branches):
+            yield ("mycompany/devops/proj-%05d" % (project_index), "feature-%05d" % (branch_index),
+                   "2025-%02d-%02dT%02d:%02d:%02d.000+00:00" % (
+                       rng.randint(1, 12), rng.randint(1, 28), rng.randint(0, 23), rng.randint(0, 59), rng.randint(0, 59)))
+
+def use_layout(layout):
+    ## "yaml-py" forces the pure-Python YAML classes
+    if layout == "yaml-py":
+        gitlab_plan.YAML_LOADER = yaml.SafeLoader
+        gitlab_plan.YAML_DUMPER = yaml.SafeDumper
+
+def run_step(step, layout, plan_file, args):
+    ## child process: one timed step, result printed as JSON
+    use_layout(layout)
+    started = time.perf_counter()
+    if step == "write":
+        gitlab_plan.write_plan(plan_file, plan_records(args.projects, args.branches, args.seed))
+    elif step == "read":
+        num_branches = sum(1 for _ in gitlab_plan.iter_plan_records(plan_file))
+        assert num_branches == args.projects * args.branches, num_branches
+    elif step == "lookup":
+        project_path = "mycompany/devops/proj-%05d" % (args.projects // 2)
+        if layout == "sqlite":
+            plan_db = gitlab_plan.PlanDatabase(plan_file)
+            project_branches = plan_db.project_branches(project_path)
+            plan_db.close()
+        else:
+            project_branches = {branch: date for project, branch, date in gitlab_plan.iter_plan_records(plan_file) if project == project_path}
+        assert len(project_branches) == args.branches, len(project_branches)
+    print(json.dumps({"seconds": time.perf_counter() - started}))
+
+def max_rss_bytes(rusage):
+    ## ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    if sys.platform == "darwin":
+        return rusage.ru_maxrss
+    return rusage.ru_maxrss * 1024
+
+def measure(step, layout, plan_file, args):
+    process = subprocess.Popen(
+        [sys.executable, __file__, "--step", step, "--layout", layout, "--plan-file", plan_file,
+         "--projects", str(args.projects), "--branches", str(args.branches), "--seed", str(args.seed)],
+        stdout=subprocess.PIPE, text=True)
+    output = process.stdout.read()
+    _, status, rusage = os.wait4(process.pid, 0)
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise SystemExit("ERROR: %s %s failed" % (step, layout))
+    return json.loads(output)["seconds"], max_rss_bytes(rusage)
+
+def run_benchmarks(args, work_dir):
+    results = []
+    for layout in args.layouts:
+        plan_file = str(work_dir / ("plan-%s.%s" % (layout, LAYOUT_EXTENSIONS[layout])))
+        result = {"layout": layout, "branches": args.projects * args.branches}
+        for step in ["write", "read", "lookup"]:
+            seconds, peak_rss = measure(step, layout, plan_file, args)
+            result["%s_seconds" % (step)] = round(seconds, 3)
+            result["%s_rss_mb" % (step)] = round(peak_rss / 1048576, 1)
+        result["size_mb"] = round(os.path.getsize(plan_file) / 1048576, 2)
+        results.append(result)
+    return results
+
+def print_results(results):
+    print("%-8s %9s %9s %9s %9s %9s %9s" % ("layout", "size (MB)", "write (s)", "read (s)", "lookup (s)", "read MB", "write MB"))
+    for each_result in results:
+        print("%-8s %9.2f %9.2f %9.2f %9.3f %9.1f %9.1f" % (
+            each_result["layout"], each_result["size_mb"], each_result["write_seconds"], each_result["read_seconds"],
+            each_result["lookup_seconds"], each_result["read_rss_mb"], each_result["write_rss_mb"]))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark plan file layouts (YAML, JSON, JSONL, SQLite)")
+    parser.add_argument("--projects", type=int, default=1000, help="number of projects (default: 1000)")
+    parser.add_argument("--branches", type=int, default=100, help="branches per project (default: 100)")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for branch dates (default: 1)")
+    parser.add_argument("--layout", dest="layouts", action="append", choices=LAYOUTS, help="layout(s) to compare (flag/arg can be repeated, default: all)")
+    parser.add_argument("--json", type=str, help="also write the results as JSON to this file")
+    parser.add_argument("--step", help=argparse.SUPPRESS)
+    parser.add_argument("--plan-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.step:
+        run_step(args.step, args.layouts[0], args.plan_file, args)
+        sys.exit(0)
+
+    args.layouts = args.layouts or LAYOUTS
+    with tempfile.TemporaryDirectory(prefix="bench_plan_formats.") as work_dir:
+        print("INFO: %d projects x %d branches (libyaml %s)" % (
+            args.projects, args.branches, "available" if getattr(yaml, "__with_libyaml__", False) else "NOT available"))
+        results = run_benchmarks(args, pathlib.Path(work_dir))
+        print_results(results)
+        if args.json:
+            with open(args.json, "w") as file:
+                json.dump(results, file, indent=2)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+## Benchmark harness for query_gitlab.py
+##
+## Starts benchmarks/fake_gitlab.py with a synthetic group, then runs query_gitlab.py
+## "plan", "validate" and "apply" against it for every backend/worker combination and
+## reports wall time, API requests per branch and peak memory (max RSS) of each run.
+## The fake server is reset before every run, so apply always starts from the full
+## data set.
+##
+##   python benchmarks/bench_query_gitlab.py --projects 100 --branches 100 --latency 20 \
+##       --backend rest --backend async --workers 1 --workers 16
+import argparse
+import json
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BENCHMARK_DIR       = pathlib.Path(__file__).resolve().parent
+QUERY_GITLAB        = BENCHMARK_DIR.parent / "query_gitlab.py"
+FAKE_GITLAB         = BENCHMARK_DIR / "fake_gitlab.py"
+GROUP_PATH          = "mycompany/devops"
+DEFAULT_ACTIONS     = ["plan", "validate", "apply"]
+
+def start_server(args):
+    server = subprocess.Popen(
+        [sys.executable, str(FAKE_GITLAB), "--port", "0",
+         "--projects", str(args.projects), "--branches", str(args.branches), "--seed", str(args.seed),
+         "--latency", str(args.latency), "--rate", str(args.rate)],
+        stdout=subprocess.PIPE, text=True)
+    ## first line is "listening on http://127.0.0.1:<port>"
+    base_url = server.stdout.readline().strip().split()[-1]
+    return server, base_url
+
+def server_call(base_url, endpoint):
+    with urllib.request.urlopen(base_url + endpoint) as response:
+        return json.load(response)
+
+def max_rss_bytes(rusage):
+    ## ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    if sys.platform == "darwin":
+        return rusage.ru_maxrss
+    return rusage.ru_maxrss * 1024
+
+def run_query_gitlab(command, log_file):
+    started = time.perf_counter()
+    process = subprocess.Popen(command, stdout=log_file, stderr=subprocess.STDOUT)
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return time.perf_counter() - started, process.returncode, max_rss_bytes(rusage)
+
+def run_benchmarks(args, base_url, work_dir):
+    token_file = work_dir / "token"
+    token_file.write_text("benchmark-token\n")
+    total_branches = args.projects * args.branches
+    results = []
+    for backend in args.backend:
+        for workers in args.workers:
+            plan_file = work_dir / ("plan-%s-%d.jsonl" % (backend, workers))
+            for action in args.actions:
+                command = [
+                    sys.executable, str(QUERY_GITLAB), action,
+                    "-t", str(token_file), "-u", base_url, "-b", backend, "-w", str(workers)]
+                if action == "plan" or not plan_file.exists():
+                    command += ["-g", GROUP_PATH, "--include-subgroups", "-m", str(args.months)]
+                    if action == "plan":
+                        command += ["--outfile", str(plan_file)]
+                else:
+                    command += ["--infile", str(plan_file)]
+                server_call(base_url, "/__reset")
+                log_path = work_dir / ("%s-%s-%d.log" % (action, backend, workers))
+                with open(log_path, "w") as log_file:
+                    wall_time, returncode, peak_rss = run_query_gitlab(command, log_file)
+                request_counts = server_call(base_url, "/__stats")
+                throttled = request_counts.pop("429", 0)
+                num_requests = sum(request_counts.values())
+                results.append({
+                    "action": action,
+                    "backend": backend,
+                    "workers": workers,
+                    "branches": total_branches,
+                    "wall_seconds": round(wall_time, 3),
+                    "requests": num_requests,
+                    "requests_per_branch": round(num_requests / max(total_branches, 1), 3),
+                    "throttled": throttled,
+                    "peak_rss_mb": round(peak_rss / 1048576, 1),
+                    "returncode": returncode,
+                })
+                if returncode != 0:
+                    print("WARNING: %s %s (workers %d) exited with %d:\n%s" % (
+                        action, backend, workers, returncode, "".join(log_path.read_text().splitlines(True)[-10:])), 
+                        file=sys.stderr)
+    return results
+
+def print_results(results):
+    print("%-9s %-8s %7s %9s %9s %9s %9s %9s" % (
+        "action", "backend", "workers", "wall (s)", "requests", "req/br", "429s", "rss (MB)"))
+    for each_result in results:
+        print("%-9s %-8s %7d %9.2f %9d %9.3f %9d %9.1f" % (
+            each_result["action"], each_result["backend"], each_result["workers"], each_result["wall_seconds"],
+            each_result["requests"], each_result["requests_per_branch"], each_result["throttled"],
+            each_result["peak_rss_mb"]))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark query_gitlab.py against a local fake GitLab server")
+    parser.add_argument("--projects", type=int, default=20, help="number of projects (default: 20)")
+    parser.add_argument("--branches", type=int, default=100, help="branches per project (default: 100)")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for branch dates (default: 1)")
+    parser.add_argument("--latency", type=float, default=0, help="milliseconds added to every request (default: 0)")
+    parser.add_argument("--rate", type=float, default=0, help="server rate limit in requests per second (default: unlimited)")
+    parser.add_argument("--months", type=int, default=3, help="commit age threshold passed to -m (default: 3)")
+    parser.add_argument("--backend", action="append", choices=["rest", "graphql", "async"], help="backend(s) to compare (flag/arg can be repeated, default: rest)")
+    parser.add_argument("--workers", action="append", type=int, help="--workers value(s) to compare (flag/arg can be repeated, default: 1)")
+    parser.add_argument("--action", dest="actions", action="append", choices=DEFAULT_ACTIONS, help="action(s) to run (flag/arg can be repeated, default: all)")
+    parser.add_argument("--json", type=str, help="also write the results as JSON to this file")
+    args = parser.parse_args()
+    args.backend = args.backend or ["rest"]
+    args.workers = args.workers or [1]
+    args.actions = args.actions or DEFAULT_ACTIONS
+
+    server, base_url = start_server(args)
+    try:
+        with tempfile.TemporaryDirectory(prefix="bench_query_gitlab.") as work_dir:
+            print("INFO: %d projects x %d branches at %s (latency %gms, rate %g/s)" % (
+                args.projects, args.branches, base_url, args.latency, args.rate))
+            results = run_benchmarks(args, base_url, pathlib.Path(work_dir))
+            print_results(results)
+            if args.json:
+                with open(args.json, "w") as file:
+                    json.dump(results, file, indent=2)
+    finally:
+        server.terminate()
+        server.wait()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+## Startup-time check for query_gitlab.py
+##
+## Runs the paths that need no GitLab connection ("--help", and "plan" on an existing
+## plan file) and "import date_compare" under "python -X importtime" and fails (exit
+## status 1) when one of them imports a module it should not (python-gitlab/requests,
+## asyncio, httpx, dateutil, PyYAML where no YAML is involved) or when its median wall
+## time, minus that of a bare interpreter, is over the budget.  Bytecode caching is
+## enabled and every path is run once before timing, so the numbers match repeated
+## CI calls.
+##
+##   python benchmarks/bench_startup.py --runs 11 --budget-ms 100
+import argparse
+import json
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR       = pathlib.Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARK_DIR.parent))
+import gitlab_plan
+
+QUERY_GITLAB        = BENCHMARK_DIR.parent / "query_gitlab.py"
+DEFAULT_BUDGET_MS   = 100
+NETWORK_MODULES     = ["gitlab", "requests", "asyncio", "httpx"]
+DATE_MODULES        = ["dateutil", "numpy"]
+
+def scenarios(work_dir):
+    ## (name, interpreter arguments, modules that must not be imported)
+    return [
+        ("help", [str(QUERY_GITLAB), "--help"], NETWORK_MODULES + DATE_MODULES + ["yaml"]),
+        ("plan sqlite (json)", [str(QUERY_GITLAB), "plan", "--infile", str(work_dir / "plan.sqlite"), "-f", "json"], NETWORK_MODULES + DATE_MODULES + ["yaml"]),
+        ("plan jsonl (yaml)", [str(QUERY_GITLAB), "plan", "--infile", str(work_dir / "plan.jsonl")], NETWORK_MODULES + DATE_MODULES),
+        ("import date_compare", ["-c", "import date_compare"], NETWORK_MODULES + DATE_MODULES + ["yaml"]),
+    ]
+
+def write_plans(work_dir):
+    records = [("mycompany/devops/proj-%03d" % (project_index), "feature-%03d" % (branch_index), "2025-01-01T00:00:00.000+00:00")
+               for project_index in range(10) for branch_index in range(10)]
+    for each_file in ["plan.sqlite", "plan.jsonl"]:
+        gitlab_plan.write_plan(str(work_dir / each_file), records)
+
+def child_env():
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    return env
+
+def wall_ms(command, runs, env):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env, check=True, cwd=str(QUERY_GITLAB.parent))
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+def imported_modules(arguments, env):
+    ## {module name: cumulative import time (us)} from -X importtime
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime"] + arguments,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, env=env, check=True, cwd=str(QUERY_GITLAB.parent))
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            modules[name.strip()] = int(cumulative)
+    return modules
+
+def run_benchmarks(args, work_dir):
+    env = child_env()
+    baseline_ms = wall_ms([sys.executable, "-c", "pass"], args.runs, env)
+    results = []
+    for name, arguments, forbidden in scenarios(work_dir):
+        command = [sys.executable] + arguments
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env, cwd=str(QUERY_GITLAB.parent))
+        modules = imported_modules(arguments, env)
+        overhead_ms = wall_ms(command, args.runs, env) - baseline_ms
+        results.append({
+            "scenario": name,
+            "overhead_ms": round(overhead_ms, 1),
+            "baseline_ms": round(baseline_ms, 1),
+            "modules": len(modules),
+            "forbidden_imports": sorted(module for module in forbidden if module in modules),
+            "ok": overhead_ms <= args.budget_ms and not any(module in modules for module in forbidden),
+        })
+    return results
+
+def print_results(results, budget_ms):
+    print("%-20s %12s %8s  %s" % ("scenario", "startup ms", "modules", "result"))
+    for each_result in results:
+        if each_result["forbidden_imports"]:
+            verdict = "FAIL: imports %s" % (", ".join(each_result["forbidden_imports"]))
+        elif not each_result["ok"]:
+            verdict = "FAIL: over %dms" % (budget_ms)
+        else:
+            verdict = "ok"
+        print("%-20s %12.1f %8d  %s" % (each_result["scenario"], each_result["overhead_ms"], each_result["modules"], verdict))
+    print("(startup ms: median wall time minus a bare interpreter, %.1fms here)" % (results[0]["baseline_ms"]))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check query_gitlab.py startup time and imports against a budget")
+    parser.add_argument("--runs", type=int, default=11, help="timed runs per scenario (default: 11)")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS, help="startup budget over a bare interpreter (default: %d)" % (DEFAULT_BUDGET_MS))
+    parser.add_argument("--json", type=str, help="also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench_startup.") as work_dir:
+        write_plans(pathlib.Path(work_dir))
+        results = run_benchmarks(args, pathlib.Path(work_dir))
+    print_results(results, args.budget_ms)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+    sys.exit(0 if all(each_result["ok"] for each_result in results) else 1)
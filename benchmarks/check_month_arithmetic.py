@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+## Property check: date_compare.add_months against dateutil's relativedelta
+##
+## For random dates (biased towards month ends and leap days, naive and aware, plain
+## dates too) and random month offsets, add_months(d, n) must equal
+## d + relativedelta(months=n), or both must raise ValueError.  Needs python-dateutil;
+## exits 1 on the first mismatches.
+##
+##   python benchmarks/check_month_arithmetic.py --cases 200000
+import argparse
+import datetime
+import pathlib
+import random
+import sys
+
+BENCHMARK_DIR       = pathlib.Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARK_DIR.parent))
+import date_compare
+import dateutil.relativedelta
+
+TIMEZONES           = [None, datetime.timezone.utc, datetime.timezone(datetime.timedelta(hours=-5)), datetime.timezone(datetime.timedelta(hours=5, minutes=45))]
+
+def random_date(rng):
+    year = rng.choice([rng.randint(1, 9999), rng.randint(1990, 2040), rng.choice([1, 1900, 2000, 2024, 2100, 9999])])
+    month = rng.randint(1, 12)
+    last_day = date_compare.days_in_month(year, month)
+    day = rng.choice([rng.randint(1, last_day), last_day, min(29, last_day), min(30, last_day)])
+    if rng.random() < 0.1:
+        return datetime.date(year, month, day)
+    return datetime.datetime(
+        year, month, day, rng.randint(0, 23), rng.randint(0, 59), rng.randint(0, 59),
+        rng.choice([0, rng.randint(0, 999999)]), tzinfo=rng.choice(TIMEZONES))
+
+def random_offset(rng):
+    return rng.choice([rng.randint(-24, 24), rng.randint(-1200, 1200), rng.randint(-120000, 120000)])
+
+def outcome(function):
+    try:
+        return function()
+    except (ValueError, OverflowError):
+        return "ValueError"
+
+def run_check(args):
+    rng = random.Random(args.seed)
+    mismatches = []
+    for _ in range(args.cases):
+        dt_object = random_date(rng)
+        num_months = random_offset(rng)
+        expected = outcome(lambda: dt_object + dateutil.relativedelta.relativedelta(months=num_months))
+        result = outcome(lambda: date_compare.add_months(dt_object, num_months))
+        if result != expected or type(result) is not type(expected):
+            mismatches.append((dt_object, num_months, expected, result))
+    return mismatches
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check date_compare.add_months against dateutil's relativedelta")
+    parser.add_argument("--cases", type=int, default=200000, help="random cases (default: 200000)")
+    parser.add_argument("--seed", type=int, default=1, help="random seed (default: 1)")
+    args = parser.parse_args()
+
+    mismatches = run_check(args)
+    for dt_object, num_months, expected, result in mismatches[:10]:
+        print("MISMATCH: %r %+d months: relativedelta %r, add_months %r" % (dt_object, num_months, expected, result))
+    print("%d cases, %d mismatches" % (args.cases, len(mismatches)))
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+## Local stand-in for the GitLab API, used by the query_gitlab.py benchmarks
+##
+## Serves a synthetic group of projects and branches (deterministic for a given seed)
+## over the REST endpoints query_gitlab.py uses, plus the GraphQL queries of the
+## graphql backend.  Latency and a token-bucket rate limit (HTTP 429 + Retry-After)
+## can be added per request.  Two extra endpoints support the harness:
+##   GET /__stats    request counts by endpoint
+##   GET /__reset    rebuild the data set (undo deletions) and zero the counts
+##
+##   python benchmarks/fake_gitlab.py --projects 100 --branches 100 --latency 20
+import argparse
+import datetime
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+GROUP_ID            = 77
+GROUP_PATH          = "mycompany/devops"
+FIRST_PROJECT_ID    = 1000
+PROTECTED_BRANCH    = "main"
+MAX_BRANCH_AGE_DAYS = 720
+
+lock = threading.Lock()
+settings = {"projects": 5, "branches": 30, "seed": 1, "rate": 0, "latency": 0}
+rate_bucket = {"tokens": 0.0, "refilled_at": 0.0}
+request_counts = {}
+projects = {}
+project_ids_by_path = {}
+
+def build_projects():
+    ## every 4th project lives in a subgroup; branch dates are anchored to midnight UTC
+    ## so repeated runs on the same day classify branches identically
+    rnd = random.Random(settings["seed"])
+    today = datetime.datetime.now(datetime.timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    projects.clear()
+    project_ids_by_path.clear()
+    for project_number in range(settings["projects"]):
+        project_id = FIRST_PROJECT_ID + project_number
+        if project_number % 4 == 3:
+            project_path = "%s/sub/proj-%03d" % (GROUP_PATH, project_number)
+        else:
+            project_path = "%s/proj-%03d" % (GROUP_PATH, project_number)
+        branches = {}
+        for branch_number in range(settings["branches"]):
+            if branch_number == 0:
+                branch_name = PROTECTED_BRANCH
+            else:
+                branch_name = "feature-%05d" % (branch_number)
+            committed = today - datetime.timedelta(
+                days=rnd.randint(0, MAX_BRANCH_AGE_DAYS), seconds=rnd.randint(0, 86000))
+            branches[branch_name] = {
+                "name": branch_name,
+                "protected": branch_name == PROTECTED_BRANCH,
+                "merged": False,
+                "default": branch_name == PROTECTED_BRANCH,
+                "commit": {
+                    "id": "%040x" % (rnd.getrandbits(160)),
+                    "title": "commit on %s" % (branch_name),
+                    "committed_date": committed.strftime("%Y-%m-%dT%H:%M:%S.000+00:00"),
+                    "web_url": "https://gitlab.example/%s/-/commit/%s" % (project_path, branch_name),
+                },
+            }
+        projects[project_id] = {
+            "id": project_id,
+            "path_with_namespace": project_path,
+            "branches": branches,
+            "protected": [{"id": 1, "name": PROTECTED_BRANCH}],
+        }
+        project_ids_by_path[project_path] = project_id
+
+def graphql_project(project, offset, limit):
+    branch_names = sorted(project["branches"])
+    return {
+        "id": "gid://gitlab/Project/%d" % (project["id"]),
+        "fullPath": project["path_with_namespace"],
+        "branchRules": {"nodes": [{"name": rule["name"], "isProtected": True} for rule in project["protected"]]},
+        "repository": {"branchNames": branch_names[offset:offset + limit]},
+    }
+
+def run_graphql(query, variables):
+    ## answers the three named queries sent by gitlab_graphql.py
+    if "StaleBranchProjects" in query:
+        project_ids = [int(each_gid.rsplit("/", 1)[1]) for each_gid in variables["ids"]]
+        nodes = [graphql_project(projects[each_id], 0, variables["limit"]) for each_id in project_ids if each_id in projects]
+        return {"data": {"projects": {"pageInfo": {"hasNextPage": False, "endCursor": None}, "nodes": nodes}}}
+    if "StaleBranchNames" in query:
+        project = projects.get(project_ids_by_path.get(variables["fullPath"]))
+        if project is None:
+            return {"data": {"project": None}}
+        return {"data": {"project": graphql_project(project, variables["offset"], variables["limit"])}}
+    if "StaleBranchDates" in query:
+        data = {}
+        project = None
+        for match in re.finditer(
+                r'(p\d+): project\(fullPath: ("(?:[^"\\]|\\.)*")\)|(b\d+): tree\(ref: ("(?:[^"\\]|\\.)*")\)', query):
+            if match.group(1):
+                project_alias = match.group(1)
+                project = projects.get(project_ids_by_path.get(json.loads(match.group(2))))
+                data[project_alias] = {"repository": {}} if project else None
+            elif project is not None:
+                branch = project["branches"].get(json.loads(match.group(4))[len("refs/heads/"):])
+                if branch is not None:
+                    data[project_alias]["repository"][match.group(3)] = {
+                        "lastCommit": {"committedDate": branch["commit"]["committed_date"]}}
+                else:
+                    data[project_alias]["repository"][match.group(3)] = None
+        return {"data": data}
+    return {"errors": [{"message": "unsupported query"}]}
+
+def endpoint_name(method, path):
+    ## collapse ids and branch names so counts group by endpoint
+    path = re.sub(r"/projects/[^/]+", "/projects/:id", path)
+    path = re.sub(r"/branches/.+", "/branches/:name", path)
+    return method + " " + path
+
+class GitLabHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def count(self, key):
+        with lock:
+            request_counts[key] = request_counts.get(key, 0) + 1
+
+    def send_json(self, status_code, body, headers=None):
+        data = json.dumps(body).encode()
+        headers = dict(headers or {})
+        if self.command == "GET" and status_code == 200:
+            etag = 'W/"%s"' % (hashlib.md5(data).hexdigest())
+            headers["ETag"] = etag
+            if self.headers.get("If-None-Match") == etag:
+                self.count("304")
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for each_header, value in headers.items():
+            self.send_header(each_header, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def throttled(self):
+        ## applies latency and the token-bucket rate limit; True when answered with 429
+        if settings["latency"]:
+            time.sleep(settings["latency"] / 1000.0)
+        if not settings["rate"]:
+            return False
+        with lock:
+            now = time.monotonic()
+            rate_bucket["tokens"] = min(
+                settings["rate"], rate_bucket["tokens"] + (now - rate_bucket["refilled_at"]) * settings["rate"])
+            rate_bucket["refilled_at"] = now
+            if rate_bucket["tokens"] >= 1:
+                rate_bucket["tokens"] -= 1
+                return False
+            request_counts["429"] = request_counts.get("429", 0) + 1
+        self.send_json(429, {"message": "429 Too Many Requests"}, {"Retry-After": "1"})
+        return True
+
+    def find_project(self, identifier):
+        identifier = urllib.parse.unquote(identifier)
+        if identifier.isdigit():
+            return projects.get(int(identifier))
+        return projects.get(project_ids_by_path.get(identifier))
+
+    def paginate(self, items, query):
+        per_page = int(query.get("per_page", ["20"])[0])
+        page = int(query.get("page", ["1"])[0])
+        total_pages = max(1, (len(items) + per_page - 1) // per_page)
+        headers = {
+            "X-Total": str(len(items)),
+            "X-Total-Pages": str(total_pages),
+            "X-Page": str(page),
+            "X-Per-Page": str(per_page),
+        }
+        if page < total_pages:
+            headers["X-Next-Page"] = str(page + 1)
+            next_query = {key: values[0] for key, values in query.items()}
+            next_query["page"] = str(page + 1)
+            headers["Link"] = '<http://%s%s?%s>; rel="next"' % (
+                self.headers["Host"], self.path.split("?")[0], urllib.parse.urlencode(next_query))
+        return items[(page - 1) * per_page:page * per_page], headers
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        path = url.path
+        if path == "/__stats":
+            with lock:
+                return self.send_json(200, dict(request_counts))
+        if path == "/__reset":
+            with lock:
+                build_projects()
+                request_counts.clear()
+            return self.send_json(200, {"projects": len(projects)})
+        if self.throttled():
+            return
+        self.count(endpoint_name("GET", path))
+        if path == "/api/v4/user":
+            return self.send_json(200, {"id": 1, "username": "benchmark"})
+        match = re.match(r"^/api/v4/groups/([^/]+)$", path)
+        if match:
+            if urllib.parse.unquote(match.group(1)) not in (str(GROUP_ID), GROUP_PATH):
+                return self.send_json(404, {"message": "404 Group Not Found"})
+            return self.send_json(200, {"id": GROUP_ID, "full_path": GROUP_PATH})
+        match = re.match(r"^/api/v4/groups/([^/]+)/projects$", path)
+        if match:
+            include_subgroups = query.get("include_subgroups", ["false"])[0].lower() == "true"
+            items = [
+                {"id": project["id"], "path_with_namespace": project["path_with_namespace"], "archived": False}
+                for project in projects.values()
+                if include_subgroups or project["path_with_namespace"].count("/") == GROUP_PATH.count("/") + 1]
+            items, headers = self.paginate(items, query)
+            return self.send_json(200, items, headers)
+        match = re.match(r"^/api/v4/projects/([^/]+)$", path)
+        if match:
+            project = self.find_project(match.group(1))
+            if project is None:
+                return self.send_json(404, {"message": "404 Project Not Found"})
+            return self.send_json(200, {"id": project["id"], "path_with_namespace": project["path_with_namespace"]})
+        match = re.match(r"^/api/v4/projects/([^/]+)/(repository/branches|protected_branches)(?:/(.+))?$", path)
+        project = self.find_project(match.group(1)) if match else None
+        if match and project is None:
+            return self.send_json(404, {"message": "404 Project Not Found"})
+        if match and match.group(2) == "protected_branches":
+            items, headers = self.paginate(project["protected"], query)
+            return self.send_json(200, items, headers)
+        if match and match.group(3):
+            branch = project["branches"].get(urllib.parse.unquote(match.group(3)))
+            if branch is None:
+                return self.send_json(404, {"message": "404 Branch Not Found"})
+            return self.send_json(200, branch)
+        if match:
+            with lock:
+                items = sorted(project["branches"].values(), key=lambda branch: branch["name"])
+            if query.get("sort", [""])[0] == "updated_asc":
+                items.sort(key=lambda branch: branch["commit"]["committed_date"])
+            items, headers = self.paginate(items, query)
+            return self.send_json(200, items, headers)
+        return self.send_json(404, {"message": "404 Not Found"})
+
+    def do_POST(self):
+        url = urllib.parse.urlparse(self.path)
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.throttled():
+            return
+        self.count(endpoint_name("POST", url.path))
+        if url.path != "/api/graphql":
+            return self.send_json(404, {"message": "404 Not Found"})
+        return self.send_json(200, run_graphql(body.get("query", ""), body.get("variables") or {}))
+
+    def do_DELETE(self):
+        url = urllib.parse.urlparse(self.path)
+        if self.throttled():
+            return
+        self.count(endpoint_name("DELETE", url.path))
+        match = re.match(r"^/api/v4/projects/([^/]+)/repository/branches/(.+)$", url.path)
+        project = self.find_project(match.group(1)) if match else None
+        if project is None:
+            return self.send_json(404, {"message": "404 Not Found"})
+        with lock:
+            branch = project["branches"].pop(urllib.parse.unquote(match.group(2)), None)
+        if branch is None:
+            return self.send_json(404, {"message": "404 Branch Not Found"})
+        self.send_response(204)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+def serve(port, ready=None):
+    build_projects()
+    rate_bucket["tokens"] = float(settings["rate"])
+    rate_bucket["refilled_at"] = time.monotonic()
+    server = ThreadingHTTPServer(("127.0.0.1", port), GitLabHandler)
+    server.daemon_threads = True
+    if ready is not None:
+        ready(server.server_address[1])
+    server.serve_forever()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in GitLab API for query_gitlab.py benchmarks")
+    parser.add_argument("--port", type=int, default=8089, help="port to listen on, 0 picks a free port (default: 8089)")
+    parser.add_argument("--projects", type=int, default=5, help="number of projects (default: 5)")
+    parser.add_argument("--branches", type=int, default=30, help="branches per project, including 'main' (default: 30)")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for branch dates (default: 1)")
+    parser.add_argument("--latency", type=float, default=0, help="milliseconds added to every request (default: 0)")
+    parser.add_argument("--rate", type=float, default=0, help="requests per second before answering 429 (default: unlimited)")
+    args = parser.parse_args()
+    settings.update(projects=args.projects, branches=args.branches, seed=args.seed, rate=args.rate, latency=args.latency)
+    serve(args.port, ready=lambda port: print("listening on http://127.0.0.1:%d" % (port), flush=True))
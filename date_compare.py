@@ -1,68 +1,368 @@
 import datetime
-import dateutil.relativedelta as relativedelta
+import math
+import bisect
+import threading
+import collections
 
-dt_string_formats = {
-    r"%Y-%m-%d %H:%M:%S.%f%z",
+## Formats tried (in order) when datetime.fromisoformat() cannot read a string,
+## picked by its shape: strings starting with a digit are ISO-like, strings starting
+## with a letter have a weekday name first (git/ctime style)
+iso_string_formats = [
     r"%Y-%m-%dT%H:%M:%S.%f%z",
-    r"%Y-%m-%d %H:%M:%S.%f%Z",
-    r"%Y-%m-%dT%H:%M:%S.%f%Z",
-    r"%Y-%m-%d %H:%M:%S.%f",
-    r"%Y-%m-%dT%H:%M:%S.%f",
-    r"%Y-%m-%d %H:%M:%S%z",
     r"%Y-%m-%dT%H:%M:%S%z",
-    r"%Y-%m-%d %H:%M:%S%Z",
+    r"%Y-%m-%d %H:%M:%S.%f%z",
+    r"%Y-%m-%d %H:%M:%S%z",
+    r"%Y-%m-%dT%H:%M:%S.%f%Z",
     r"%Y-%m-%dT%H:%M:%S%Z",
-    r"%a %b %d %H:%M:%S %Y %z",
-    r"%a %b %d %H:%M:%S %Z %Y",
+    r"%Y-%m-%d %H:%M:%S.%f%Z",
+    r"%Y-%m-%d %H:%M:%S%Z",
+    r"%Y-%m-%dT%H:%M:%S.%f",
+    r"%Y-%m-%d %H:%M:%S.%f",
     r"%Y-%m-%d %H:%M:%S",
     r"%Y-%m-%d %H:%M",
     r"%Y-%m-%d"
-}
+]
+named_day_string_formats = [
+    r"%a %b %d %H:%M:%S %Y %z",
+    r"%a %b %d %H:%M:%S %Z %Y"
+]
+dt_string_formats = iso_string_formats + named_day_string_formats
+
+## strptime format that read the last string fromisoformat() could not (tried first)
+last_string_format = None
+
+## Parsed results (unreadable strings included) of the most recently used strings:
+## branches often share a head commit, so a scan sees the same date string many times
+PARSE_CACHE_SIZE    = 65536
+
+class ParseCache:
+    def __init__(self, maxsize=PARSE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.counts = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, dt_string):
+        ## returns (found, parsed result)
+        with self.lock:
+            try:
+                dt_object = self.entries[dt_string]
+            except KeyError:
+                self.counts["misses"] += 1
+                return False, None
+            self.entries.move_to_end(dt_string)
+            self.counts["hits"] += 1
+            return True, dt_object
+
+    def put(self, dt_string, dt_object):
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            self.entries[dt_string] = dt_object
+            self.entries.move_to_end(dt_string)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.counts["evictions"] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.counts = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, size=len(self.entries), maxsize=self.maxsize)
+
+parse_cache = ParseCache()
+
+def parse_cache_stats():
+    ## {"hits", "misses", "evictions", "size", "maxsize"}
+    return parse_cache.stats()
+
+def clear_parse_cache():
+    parse_cache.clear()
 
 def read_date_string_to_dtz(dt_string):
+    ## cached: a string is parsed at most once while it stays in the cache
+    if not isinstance(dt_string, str):
+        return parse_date_string_to_dtz(dt_string)
+    found, dt_object = parse_cache.get(dt_string)
+    if not found:
+        dt_object = parse_date_string_to_dtz(dt_string)
+        parse_cache.put(dt_string, dt_object)
+    return dt_object
+
+def parse_date_string_to_dtz(dt_string):
     # print(f"INFO: Attempting to convert string \"{dt_string}\"")
-    for each_format in dt_string_formats:
+    global last_string_format
+    ## GitLab dates are ISO 8601: one call, no failed attempts
+    try:
+        dt_object = datetime.datetime.fromisoformat(dt_string)
+    except (TypeError, ValueError):
+        pass
+    else:
+        return(dt_object.astimezone())
+    if not isinstance(dt_string, str) or not dt_string:
+        return(False)
+    if dt_string[0].isdigit():
+        candidate_formats = iso_string_formats
+    else:
+        candidate_formats = named_day_string_formats
+    if last_string_format in candidate_formats:
+        candidate_formats = [last_string_format] + [each_format for each_format in candidate_formats if each_format != last_string_format]
+    for each_format in candidate_formats:
         # print(f"DEBUG: testing format: \"{each_format}\"")
         try:
             dt_object = datetime.datetime.strptime(dt_string, each_format)
-        except:
+        except ValueError:
             pass
         else:
+            last_string_format = each_format
             return(dt_object.astimezone())
     return(False)
 
+## Month arithmetic without dateutil: N months before/after keeps the time of day and
+## tzinfo and clamps the day to the end of a shorter month (Mar 31 - 1 month = Feb 28/29),
+## as dateutil's relativedelta(months=N) does.  Set MONTH_ARITHMETIC = "dateutil" to use
+## relativedelta itself (dateutil is then imported on first use).
+MONTH_ARITHMETIC    = "builtin"
+DAYS_IN_MONTH       = [0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+
+def is_leap_year(year):
+    return year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+
+def days_in_month(year, month):
+    if month == 2 and is_leap_year(year):
+        return 29
+    return DAYS_IN_MONTH[month]
+
+def add_months(dt_object, num_months):
+    ## num_months may be negative; ValueError if the result is outside years 1-9999
+    if MONTH_ARITHMETIC == "dateutil":
+        import dateutil.relativedelta
+        return dt_object + dateutil.relativedelta.relativedelta(months=num_months)
+    if int(num_months) != num_months:
+        raise ValueError("Non-integer years and months are ambiguous and not currently supported.")
+    year, month_index = divmod(dt_object.year * 12 + dt_object.month - 1 + int(num_months), 12)
+    if not datetime.MINYEAR <= year <= datetime.MAXYEAR:
+        raise ValueError("year %d is out of range" % (year))
+    month = month_index + 1
+    return dt_object.replace(year=year, month=month, day=min(dt_object.day, days_in_month(year, month)))
+
+## The functions below build a new AgeCutoff (a new "now") on every call; a scan 
+## should create one AgeCutoff and reuse it
+
 def datetime_1_month_ago():
-    dt_now  = datetime.datetime.now().astimezone()
-    dt_then = dt_now - relativedelta.relativedelta(months=1)
-    return dt_then
+    return AgeCutoff(1).cutoff
 
 def datetime_6_months_ago():
-    dt_now  = datetime.datetime.now().astimezone()
-    dt_then = dt_now - relativedelta.relativedelta(months=6)
-    return dt_then
+    return AgeCutoff(6).cutoff
 
 def datetime_x_months_ago(num_months=3):
-    dt_now  = datetime.datetime.now().astimezone()
-    dt_then = dt_now - relativedelta.relativedelta(months=num_months)
-    return dt_then
+    return AgeCutoff(num_months).cutoff
 
 def date_more_than_one_month_ago(dt_string):
-    dt_target = read_date_string_to_dtz(dt_string)
-    if dt_target < datetime_1_month_ago():
-        return True
-    else:
-        return False
+    return AgeCutoff(1).older_than(dt_string)
 
 def date_more_than_six_months_ago(dt_string):
-    dt_target = read_date_string_to_dtz(dt_string)
-    if dt_target < datetime_6_months_ago():
-        return True
-    else:
-        return False
+    return AgeCutoff(6).older_than(dt_string)
 
 def date_more_than_x_months_ago(dt_string, num_months=3):
-    dt_target = read_date_string_to_dtz(dt_string)
-    if dt_target < datetime_x_months_ago(num_months):
-        return True
-    else:
-        return False
+    return AgeCutoff(num_months).older_than(dt_string)
+
+##
+## Batch classification: parse a whole list of date strings to epoch seconds once and
+## compare against a single cutoff.  With NumPy installed, ISO 8601 strings with an
+## offset or "Z" (every GitLab committed_date) are converted without a Python-level
+## loop; anything else goes through read_date_string_to_dtz.  Results are NumPy arrays
+## with NumPy, lists without it.
+##
+
+## NumPy is optional and slow to import: looked up on the first large batch (below
+## NUMPY_MIN_BATCH strings its fixed cost per call is higher than the Python loop)
+NUMPY_MIN_BATCH = 256
+numpy_module = None
+
+def load_numpy():
+    global numpy_module
+    if numpy_module is None:
+        try:
+            import numpy
+        except ImportError:
+            numpy = False
+        numpy_module = numpy
+    return numpy_module or None
+
+def date_string_to_epoch(dt_string):
+    dt_object = read_date_string_to_dtz(dt_string)
+    if dt_object is False:
+        raise ValueError("unrecognized date string: %r" % (dt_string))
+    return math.floor(dt_object.timestamp())
+
+## positions of the digits in "YYYY-MM-DDTHH:MM:SS"
+ISO_DIGIT_COLUMNS   = [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18]
+
+def iso_strings_to_epoch(numpy, dt_strings):
+    ## (epoch seconds, rows read) for "YYYY-MM-DD[T ]HH:MM:SS[.digits](Z|+HH:MM|-HH:MM)"
+    ## strings: the characters are read as a 2-D array of code points and the fields 
+    ## computed with integer arithmetic (no per-string parsing)
+    values = numpy.asarray(dt_strings, dtype=str)
+    num_values = len(values)
+    width = values.dtype.itemsize // 4
+    epochs = numpy.zeros(num_values, dtype=numpy.int64)
+    if num_values == 0 or width < 20:
+        return epochs, numpy.zeros(num_values, dtype=bool)
+    codes = values.view(numpy.uint32).reshape(num_values, width).astype(numpy.int32)
+    lengths = numpy.count_nonzero(codes, axis=1)
+    rows = numpy.arange(num_values)
+    ## offset: "Z", or sign, two digits, ":", two digits at the end
+    zulu = codes[rows, lengths - 1] == ord("Z")
+    offset_start = numpy.maximum(lengths - 6, 0)
+    offset_chars = codes[rows[:, None], offset_start[:, None] + numpy.arange(6)]
+    offset_digits = offset_chars[:, [1, 2, 4, 5]] - ord("0")
+    has_offset = (((offset_chars[:, 0] == ord("+")) | (offset_chars[:, 0] == ord("-")))
+        & (offset_chars[:, 3] == ord(":"))
+        & numpy.all((offset_digits >= 0) & (offset_digits <= 9), axis=1))
+    tz_start = numpy.where(zulu, lengths - 1, offset_start)
+    ## fixed separators and digits, and only digits between "." and the offset
+    digits = codes[:, :19] - ord("0")
+    field_digits = digits[:, ISO_DIGIT_COLUMNS]
+    fraction = codes[:, 20:]
+    fraction_columns = numpy.arange(20, width)[None, :] < tz_start[:, None]
+    readable = ((zulu | has_offset) & (lengths >= 20)
+        & numpy.all((field_digits >= 0) & (field_digits <= 9), axis=1)
+        & (codes[:, 4] == ord("-")) & (codes[:, 7] == ord("-"))
+        & ((codes[:, 10] == ord("T")) | (codes[:, 10] == ord(" ")))
+        & (codes[:, 13] == ord(":")) & (codes[:, 16] == ord(":"))
+        & ((tz_start == 19) | ((codes[:, 19] == ord(".")) & (tz_start > 20)))
+        & numpy.all(((fraction >= ord("0")) & (fraction <= ord("9"))) | ~fraction_columns, axis=1))
+    year = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+    month = digits[:, 5] * 10 + digits[:, 6]
+    day = digits[:, 8] * 10 + digits[:, 9]
+    hour = digits[:, 11] * 10 + digits[:, 12]
+    minute = digits[:, 14] * 10 + digits[:, 15]
+    second = digits[:, 17] * 10 + digits[:, 18]
+    leap_day = (month == 2) & (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    month_days = numpy.array(DAYS_IN_MONTH)[numpy.clip(month, 0, 12)] + leap_day
+    readable &= ((month >= 1) & (month <= 12) & (day >= 1) & (day <= month_days)
+        & (hour <= 23) & (minute <= 59) & (second <= 59))
+    ## days since 1970-01-01 of a proleptic Gregorian date (H. Hinnant's days_from_civil)
+    march_year = year - (month <= 2)
+    era = march_year // 400
+    year_of_era = march_year - era * 400
+    day_of_year = (153 * numpy.where(month > 2, month - 3, month + 9) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    days = (era * 146097 + day_of_era - 719468).astype(numpy.int64)
+    offset_seconds = (offset_digits[:, 0] * 10 + offset_digits[:, 1]) * 3600 + (offset_digits[:, 2] * 10 + offset_digits[:, 3]) * 60
+    offset_seconds = numpy.where(offset_chars[:, 0] == ord("-"), -offset_seconds, offset_seconds)
+    offset_seconds = numpy.where(zulu, 0, offset_seconds)
+    epochs = days * 86400 + hour * 3600 + minute * 60 + second - offset_seconds
+    epochs[~readable] = 0
+    return epochs, readable
+
+def dates_to_epoch_seconds(dt_strings, use_numpy=True):
+    ## epoch seconds (floored) of every date string; ValueError for one that cannot be read
+    if not hasattr(dt_strings, "__len__"):
+        dt_strings = list(dt_strings)
+    numpy = None
+    if use_numpy and len(dt_strings) >= NUMPY_MIN_BATCH:
+        numpy = load_numpy()
+    if numpy is None:
+        return [date_string_to_epoch(dt_string) for dt_string in dt_strings]
+    epochs, readable = iso_strings_to_epoch(numpy, dt_strings)
+    for index in numpy.flatnonzero(~readable):
+        epochs[index] = date_string_to_epoch(str(dt_strings[index]))
+    return epochs
+
+def dates_more_than_x_months_ago(dt_strings, num_months=3, use_numpy=True):
+    ## boolean mask, same order as dt_strings: True where the date is older than the cutoff
+    return AgeCutoff(num_months).older_than_many(dt_strings, use_numpy)
+
+def date_ages_in_seconds(dt_strings, use_numpy=True):
+    ## age (now minus date) of every date string, in seconds
+    return AgeCutoff().ages(dt_strings, use_numpy)
+
+
+##
+## AgeCutoff: "now" and "now minus N months" fixed once (e.g. per scan), kept as 
+## integer epoch seconds so every comparison is one int comparison after parsing
+##
+
+class AgeCutoff:
+    def __init__(self, num_months=3, now=None):
+        if now is None:
+            now = datetime.datetime.now().astimezone()
+        self.num_months = num_months
+        self.now = now
+        self.cutoff = add_months(now, -num_months)
+        self.now_epoch = math.floor(now.timestamp())
+        ## rounded up: a whole-second date compares with it exactly as with the datetime
+        self.cutoff_epoch = math.ceil(self.cutoff.timestamp())
+
+    def older_than(self, dt_string):
+        ## True if the date is before the cutoff (ValueError if it cannot be read)
+        return date_string_to_epoch(dt_string) < self.cutoff_epoch
+
+    def older_than_many(self, dt_strings, use_numpy=True):
+        ## boolean mask (NumPy array, or list without NumPy / for small batches)
+        epochs = dates_to_epoch_seconds(dt_strings, use_numpy)
+        if isinstance(epochs, list):
+            return [epoch < self.cutoff_epoch for epoch in epochs]
+        return epochs < self.cutoff_epoch
+
+    def ages(self, dt_strings, use_numpy=True):
+        ## age (now minus date) of every date string, in seconds
+        epochs = dates_to_epoch_seconds(dt_strings, use_numpy)
+        if isinstance(epochs, list):
+            return [self.now_epoch - epoch for epoch in epochs]
+        return self.now_epoch - epochs
+
+
+##
+## AgeBuckets: histogram of ages over month boundaries (e.g. <1m, 1-3m, 3-6m, 6-12m,
+## >12m) in one pass; every boundary's cutoff is computed once and each date is
+## placed with a binary search over the cutoffs
+##
+
+DEFAULT_AGE_BUCKETS = [1, 3, 6, 12]     ## months
+
+class AgeBuckets:
+    def __init__(self, bucket_months=DEFAULT_AGE_BUCKETS, now=None):
+        if now is None:
+            now = datetime.datetime.now().astimezone()
+        self.bucket_months = sorted(set(bucket_months))
+        if not self.bucket_months or self.bucket_months[0] <= 0:
+            raise ValueError("age bucket boundaries must be positive months: %r" % (bucket_months))
+        self.now = now
+        ## oldest cutoff first, so bisect counts the boundaries a date is not older than
+        self.cutoff_epochs = [AgeCutoff(num_months, now).cutoff_epoch for num_months in reversed(self.bucket_months)]
+        ## youngest bucket first
+        self.labels = ["<%dm" % (self.bucket_months[0])]
+        for lower, upper in zip(self.bucket_months, self.bucket_months[1:]):
+            self.labels.append("%d-%dm" % (lower, upper))
+        self.labels.append(">%dm" % (self.bucket_months[-1]))
+
+    def bucket_of_epoch(self, epoch):
+        ## index into self.labels
+        return len(self.cutoff_epochs) - bisect.bisect_right(self.cutoff_epochs, epoch)
+
+    def bucket_of(self, dt_string):
+        return self.bucket_of_epoch(date_string_to_epoch(dt_string))
+
+    def histogram(self, dt_strings, with_members=False):
+        ## {"labels": [...], "counts": [...]} plus "members" (indices into dt_strings,
+        ## per bucket) when asked; dt_strings can be any iterable, read once
+        counts = [0] * len(self.labels)
+        members = [[] for _ in self.labels] if with_members else None
+        for index, dt_string in enumerate(dt_strings):
+            bucket = self.bucket_of(dt_string)
+            counts[bucket] += 1
+            if with_members:
+                members[bucket].append(index)
+        result = {"labels": list(self.labels), "counts": counts}
+        if with_members:
+            result["members"] = members
+        return result
+
+def age_histogram(dt_strings, bucket_months=DEFAULT_AGE_BUCKETS, with_members=False):
+    return AgeBuckets(bucket_months).histogram(dt_strings, with_members)
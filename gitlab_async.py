@@ -0,0 +1,138 @@
+## asyncio GitLab REST client used by query_gitlab.py ("--backend async")
+##
+## Talks to the REST API directly over one pooled, keep-alive httpx client (HTTP/2
+## when the optional "h2" package is installed), with a bounded number of requests
+## in flight.  HTTP 429 pauses every request until Retry-After has passed and the
+## request is retried; transient 5xx errors are retried with exponential backoff.
+##   pip install httpx        (HTTP/2: pip install "httpx[http2]")
+import time
+import urllib.parse
+import gitlab_ratelimit
+import lazy_modules
+
+## (loaded on first use; httpx and h2 are None when not installed)
+asyncio = lazy_modules.lazy_import("asyncio")
+httpx = lazy_modules.lazy_import("httpx", optional=True)
+h2 = lazy_modules.lazy_import("h2", optional=True)
+
+DEFAULT_CONCURRENCY = 64            ## requests in flight when --workers is not given
+REQUEST_TIMEOUT     = 60
+MAX_RETRIES         = 10
+RETRY_BACKOFF       = 0.5           ## seconds, doubled on every retry of a 5xx
+
+class AsyncGitLabError(Exception):
+    def __init__(self, response_code, message):
+        super().__init__("%s: %s" % (response_code, message))
+        self.response_code = response_code
+
+def quote_path(identifier):
+    return urllib.parse.quote(str(identifier), safe="")
+
+class AsyncGitLab:
+    def __init__(self, base_url, private_token, concurrency=DEFAULT_CONCURRENCY, on_response=None):
+        if httpx is None:
+            raise ImportError("the async backend requires httpx (pip install httpx)")
+        self.base_url = base_url.rstrip("/") + "/api/v4"
+        self.private_token = private_token
+        self.concurrency = max(1, concurrency)
+        self.http2 = h2 is not None
+        self.client = None
+        self.semaphore = None
+        self.paused_until = 0.0
+        self.request_count = 0
+        self.throttled = 0
+        ## optional callback(method, url, status_code, seconds, bytes_received, bytes_sent)
+        self.on_response = on_response
+
+    async def __aenter__(self):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers={"PRIVATE-TOKEN": self.private_token},
+            http2=self.http2,
+            timeout=REQUEST_TIMEOUT,
+            limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.client.aclose()
+
+    async def request(self, method, path, params=None):
+        backoff = RETRY_BACKOFF
+        for attempt in range(MAX_RETRIES + 1):
+            async with self.semaphore:
+                pause = self.paused_until - time.monotonic()
+                if pause > 0:
+                    await asyncio.sleep(pause)
+                started = time.monotonic()
+                response = await self.client.request(method, path, params=params)
+                self.request_count += 1
+            if self.on_response is not None:
+                self.on_response(
+                    method, response.url, response.status_code, time.monotonic() - started,
+                    len(response.content), len(response.request.content))
+            if response.status_code == 429 and attempt < MAX_RETRIES:
+                self.throttled += 1
+                retry_after = gitlab_ratelimit.parse_retry_after(response.headers.get("Retry-After"))
+                if retry_after is None:
+                    retry_after = backoff
+                    backoff *= 2
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+                continue
+            if response.status_code >= 500 and attempt < MAX_RETRIES:
+                await asyncio.sleep(backoff)
+                backoff *= 2
+                continue
+            if response.status_code >= 400:
+                try:
+                    message = response.json().get("message", response.text)
+                except ValueError:
+                    message = response.text
+                raise AsyncGitLabError(response.status_code, message)
+            return response
+
+    async def get_json(self, path, params=None):
+        response = await self.request("GET", path, params)
+        return response.json()
+
+    async def delete(self, path):
+        await self.request("DELETE", path)
+
+    async def iter_pages(self, path, params=None, per_page=100):
+        ## yields one page of items at a time, following X-Next-Page; stop iterating to
+        ## skip the remaining pages
+        page_params = dict(params or {}, per_page=per_page, page=1)
+        while True:
+            response = await self.request("GET", path, page_params)
+            yield response.json()
+            next_page = response.headers.get("X-Next-Page")
+            if not next_page:
+                return
+            page_params = dict(page_params, page=int(next_page))
+
+    async def first_page(self, path, params=None, per_page=100):
+        ## the response for page 1 (its X-Total-Pages header tells how many follow)
+        return await self.request("GET", path, dict(params or {}, per_page=per_page, page=1))
+
+    async def list_all(self, path, params=None, per_page=100, response=None):
+        ## fetches page 1 (unless its response is passed in), then all remaining pages at
+        ## once (X-Total-Pages); falls back to following X-Next-Page when the server 
+        ## omits the total (very large listings)
+        page_params = dict(params or {}, per_page=per_page, page=1)
+        if response is None:
+            response = await self.first_page(path, params, per_page)
+        items = response.json()
+        total_pages = response.headers.get("X-Total-Pages")
+        if total_pages:
+            pages = await asyncio.gather(*(
+                self.get_json(path, dict(page_params, page=page_number))
+                for page_number in range(2, int(total_pages) + 1)))
+            for each_page in pages:
+                items.extend(each_page)
+            return items
+        next_page = response.headers.get("X-Next-Page")
+        while next_page:
+            response = await self.request("GET", path, dict(page_params, page=int(next_page)))
+            items.extend(response.json())
+            next_page = response.headers.get("X-Next-Page")
+        return items
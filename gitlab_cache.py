@@ -0,0 +1,197 @@
+## On-disk (SQLite) metadata cache used by query_gitlab.py ("--cache")
+##
+## Stores project path <-> id mappings and snapshots of paged listings (branch names
+## with their head commit SHA/date, protected branches).  Entries younger than the
+## TTL are used without any request; older entries are revalidated with a conditional
+## request (If-None-Match) so unchanged data costs a 304 instead of a full response.
+import sqlite3
+import pathlib
+import threading
+import time
+import json
+import urllib.parse
+import lazy_modules
+
+gitlab = lazy_modules.lazy_import("gitlab")
+
+DEFAULT_CACHE_FILE  = "~/.cache/query_gitlab/metadata.sqlite"
+DEFAULT_TTL         = 900           ## seconds before a cached entry is revalidated
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+    id          INTEGER PRIMARY KEY,
+    path        TEXT NOT NULL,
+    etag        TEXT,
+    fetched_at  REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS project_aliases (
+    alias       TEXT PRIMARY KEY,
+    project_id  INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    key         TEXT PRIMARY KEY,
+    etag        TEXT,
+    body        TEXT NOT NULL,
+    next_page   INTEGER,
+    fetched_at  REAL NOT NULL
+);
+"""
+
+class MetadataCache:
+    def __init__(self, filepath=DEFAULT_CACHE_FILE, ttl=DEFAULT_TTL):
+        self.filepath = pathlib.Path(filepath).expanduser()
+        self.filepath.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(str(self.filepath), check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+        self.connection.commit()
+        self.counts = {"fresh": 0, "revalidated": 0, "fetched": 0}
+
+    def count(self, kind):
+        with self.lock:
+            self.counts[kind] += 1
+
+    def is_fresh(self, fetched_at):
+        return time.time() - fetched_at < self.ttl
+
+    def get_project(self, identifier):
+        ## returns (id, path, etag, fetched_at) or None
+        with self.lock:
+            return self.connection.execute(
+                "SELECT p.id, p.path, p.etag, p.fetched_at FROM project_aliases a "
+                "JOIN projects p ON p.id = a.project_id WHERE a.alias = ?",
+                (str(identifier),)).fetchone()
+
+    def put_project(self, identifier, project_id, project_path, etag):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO projects (id, path, etag, fetched_at) VALUES (?, ?, ?, ?)",
+                (project_id, project_path, etag, time.time()))
+            for each_alias in {str(identifier), str(project_id), project_path}:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO project_aliases (alias, project_id) VALUES (?, ?)",
+                    (each_alias, project_id))
+            self.connection.commit()
+
+    def touch_project(self, project_id):
+        with self.lock:
+            self.connection.execute("UPDATE projects SET fetched_at = ? WHERE id = ?", (time.time(), project_id))
+            self.connection.commit()
+
+    def get_page(self, key):
+        ## returns (etag, body, next_page, fetched_at) or None
+        with self.lock:
+            return self.connection.execute(
+                "SELECT etag, body, next_page, fetched_at FROM pages WHERE key = ?", (key,)).fetchone()
+
+    def put_page(self, key, etag, body, next_page):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO pages (key, etag, body, next_page, fetched_at) VALUES (?, ?, ?, ?, ?)",
+                (key, etag, json.dumps(body), next_page, time.time()))
+            self.connection.commit()
+
+    def touch_page(self, key):
+        with self.lock:
+            self.connection.execute("UPDATE pages SET fetched_at = ? WHERE key = ?", (time.time(), key))
+            self.connection.commit()
+
+    def drop_pages(self, path):
+        ## forget every cached page of a listing (e.g. after branches were deleted)
+        with self.lock:
+            self.connection.execute("DELETE FROM pages WHERE key LIKE ?", (path + "?%",))
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+def page_key(path, query_data):
+    return path + "?" + urllib.parse.urlencode(sorted(query_data.items()))
+
+def conditional_get(gl, path, query_data, etag):
+    ## returns the response, or None when the server answered 304 Not Modified
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    try:
+        return gl.http_request("get", path, query_data=query_data, extra_headers=headers)
+    except gitlab.exceptions.GitlabHttpError as e:
+        if e.response_code == 304:
+            return None
+        raise
+
+def cached_project(cache, gl, identifier, on_request=None):
+    ## returns (id, path_with_namespace) for a project id or full path
+    cached = cache.get_project(identifier)
+    if cached is not None and cache.is_fresh(cached[3]):
+        cache.count("fresh")
+        return cached[0], cached[1]
+    path = "/projects/%s" % (urllib.parse.quote(str(identifier), safe=""))
+    response = conditional_get(gl, path, {}, cached[2] if cached is not None else None)
+    if on_request: on_request()
+    if response is None:
+        cache.count("revalidated")
+        cache.touch_project(cached[0])
+        return cached[0], cached[1]
+    cache.count("fetched")
+    project = response.json()
+    cache.put_project(identifier, project["id"], project["path_with_namespace"], response.headers.get("ETag"))
+    return project["id"], project["path_with_namespace"]
+
+def cached_list(cache, gl, path, query_data=None, per_page=100, reduce_item=None, on_request=None):
+    ## yields the items of a paged listing, page by page, from the cache where possible;
+    ## reduce_item (optional) trims each item before it is stored
+    page_number = 1
+    while page_number:
+        page_query = dict(query_data or {}, per_page=per_page, page=page_number)
+        key = page_key(path, page_query)
+        cached = cache.get_page(key)
+        if cached is not None and cache.is_fresh(cached[3]):
+            cache.count("fresh")
+            items, next_page = json.loads(cached[1]), cached[2]
+        else:
+            response = conditional_get(gl, path, page_query, cached[0] if cached is not None else None)
+            if on_request: on_request()
+            if response is None:
+                cache.count("revalidated")
+                cache.touch_page(key)
+                items, next_page = json.loads(cached[1]), cached[2]
+            else:
+                cache.count("fetched")
+                items = response.json()
+                if reduce_item is not None:
+                    items = [reduce_item(each_item) for each_item in items]
+                next_page = int(response.headers.get("X-Next-Page") or 0) or None
+                cache.put_page(key, response.headers.get("ETag"), items, next_page)
+        for each_item in items:
+            yield each_item
+        page_number = next_page
+
+def cached_page_count(cache, path, query_data=None, per_page=100):
+    ## number of pages of a paged listing as last cached (fresh or not), without any
+    ## request; None when its first page is not cached
+    page_count = 0
+    page_number = 1
+    while page_number:
+        cached = cache.get_page(page_key(path, dict(query_data or {}, per_page=per_page, page=page_number)))
+        if cached is None:
+            return page_count or None
+        page_count += 1
+        page_number = cached[2]
+    return page_count
+
+def reduce_branch(branch):
+    ## keep only what the scan and validation need from a branch listing
+    commit = branch.get("commit") or {}
+    return {
+        "name": branch["name"],
+        "protected": branch.get("protected", False),
+        "commit": {
+            "id": commit.get("id"),
+            "committed_date": commit.get("committed_date"),
+            "title": commit.get("title"),
+            "web_url": commit.get("web_url"),
+        },
+    }
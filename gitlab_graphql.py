@@ -0,0 +1,146 @@
+## Batched GitLab GraphQL queries used by query_gitlab.py ("--backend graphql")
+##   https://docs.gitlab.com/ee/api/graphql/reference/
+##
+## Branch names and protection rules for many projects are read with one query per
+## batch of projects, then last-commit dates for many branches (across projects) are
+## read with one aliased query per batch of branches.
+import json
+import fnmatch
+
+DEFAULT_BATCH_SIZE  = 50            ## projects or branches per query (keep under the complexity limit)
+BRANCH_NAMES_LIMIT  = 1000          ## branch names per project per query (paged with offset)
+REQUEST_TIMEOUT     = 60
+
+PROJECTS_QUERY = """
+query StaleBranchProjects($ids: [ID!], $first: Int, $after: String, $limit: Int!) {
+  projects(ids: $ids, first: $first, after: $after) {
+    pageInfo { hasNextPage endCursor }
+    nodes {
+      id
+      fullPath
+      branchRules { nodes { name isProtected } }
+      repository { branchNames(searchPattern: "*", offset: 0, limit: $limit) }
+    }
+  }
+}
+"""
+
+BRANCH_NAMES_QUERY = """
+query StaleBranchNames($fullPath: ID!, $offset: Int!, $limit: Int!) {
+  project(fullPath: $fullPath) {
+    repository { branchNames(searchPattern: "*", offset: $offset, limit: $limit) }
+  }
+}
+"""
+
+class GraphQLError(Exception):
+    pass
+
+def graphql_endpoint(base_url):
+    return base_url.rstrip("/") + "/api/graphql"
+
+def run_query(session, endpoint, token, query, variables=None):
+    try:
+        response = session.post(
+            endpoint,
+            json={"query": query, "variables": variables or {}},
+            headers={"Authorization": "Bearer %s" % (token)},
+            timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        payload = response.json()
+    except Exception as e:
+        raise GraphQLError("request to %r failed: %s" % (endpoint, e))
+    if payload.get("errors"):
+        raise GraphQLError("; ".join(each_error.get("message", "unknown error") for each_error in payload["errors"]))
+    return payload.get("data") or {}
+
+def chunked(items, size):
+    chunk = []
+    for each_item in items:
+        chunk.append(each_item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def project_gid(project_id):
+    return "gid://gitlab/Project/%s" % (project_id)
+
+def is_protected(branch_name, protected_rules):
+    ## branch rules may be wildcards (e.g. "release/*")
+    for each_rule in protected_rules:
+        if branch_name == each_rule or fnmatch.fnmatchcase(branch_name, each_rule):
+            return True
+    return False
+
+def fetch_remaining_branch_names(session, endpoint, token, full_path, offset, on_query=None):
+    branch_names = []
+    while True:
+        data = run_query(session, endpoint, token, BRANCH_NAMES_QUERY,
+            {"fullPath": full_path, "offset": offset, "limit": BRANCH_NAMES_LIMIT})
+        if on_query: on_query()
+        page_names = ((data.get("project") or {}).get("repository") or {}).get("branchNames") or []
+        branch_names.extend(page_names)
+        offset += len(page_names)
+        if len(page_names) < BRANCH_NAMES_LIMIT:
+            return branch_names
+
+def fetch_projects(session, endpoint, token, project_ids, batch_size=DEFAULT_BATCH_SIZE, on_query=None):
+    ## yields one dict per project: {"path": ..., "protected": [rule names], "branches": [names]}
+    ## on_query (optional) is called once per GraphQL request sent
+    for each_batch in chunked(project_ids, batch_size):
+        after = None
+        while True:
+            data = run_query(session, endpoint, token, PROJECTS_QUERY,
+                {"ids": [project_gid(each_id) for each_id in each_batch],
+                 "first": len(each_batch),
+                 "after": after,
+                 "limit": BRANCH_NAMES_LIMIT})
+            if on_query: on_query()
+            connection = data.get("projects") or {}
+            for each_node in connection.get("nodes") or []:
+                branch_names = list((each_node.get("repository") or {}).get("branchNames") or [])
+                if len(branch_names) >= BRANCH_NAMES_LIMIT:
+                    branch_names.extend(fetch_remaining_branch_names(
+                        session, endpoint, token, each_node["fullPath"], len(branch_names), on_query))
+                protected_rules = [
+                    each_rule["name"]
+                    for each_rule in (each_node.get("branchRules") or {}).get("nodes") or []
+                    if each_rule.get("isProtected")]
+                yield {"path": each_node["fullPath"], "protected": protected_rules, "branches": branch_names}
+            page_info = connection.get("pageInfo") or {}
+            if not page_info.get("hasNextPage"):
+                break
+            after = page_info.get("endCursor")
+
+def build_commit_dates_query(project_branches):
+    ## project_branches: list of (project path, branch name); strings are JSON-quoted,
+    ## which is valid GraphQL string syntax
+    projects = {}
+    for project_path, branch_name in project_branches:
+        projects.setdefault(project_path, []).append(branch_name)
+    query_lines = ["query StaleBranchDates {"]
+    aliases = {}
+    for project_index, project_path in enumerate(projects):
+        query_lines.append("  p%d: project(fullPath: %s) { repository {" % (project_index, json.dumps(project_path)))
+        for branch_index, branch_name in enumerate(projects[project_path]):
+            query_lines.append("    b%d: tree(ref: %s) { lastCommit { committedDate } }" % (
+                branch_index, json.dumps("refs/heads/" + branch_name)))
+            aliases[("p%d" % project_index, "b%d" % branch_index)] = (project_path, branch_name)
+        query_lines.append("  } }")
+    query_lines.append("}")
+    return "\n".join(query_lines), aliases
+
+def fetch_commit_dates(session, endpoint, token, project_branches):
+    ## returns [(project path, branch name, committed date)] for one batch; branches
+    ## that no longer resolve to a commit are left out
+    query, aliases = build_commit_dates_query(project_branches)
+    data = run_query(session, endpoint, token, query)
+    commit_dates = []
+    for (project_alias, branch_alias), (project_path, branch_name) in aliases.items():
+        repository = (data.get(project_alias) or {}).get("repository") or {}
+        last_commit = (repository.get(branch_alias) or {}).get("lastCommit") or {}
+        if last_commit.get("committedDate"):
+            commit_dates.append((project_path, branch_name, last_commit["committedDate"]))
+    return commit_dates
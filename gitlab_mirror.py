@@ -0,0 +1,77 @@
+## Local bare-mirror backend used by query_gitlab.py ("--backend git-mirror")
+##
+## Keeps a partial (--filter=blob:none) bare mirror of each project's branches under a
+## cache directory.  A scan costs one "git fetch --prune" per repository (a clone the
+## first time), and every branch's committer date comes from a single
+## "git for-each-ref" call.  The source can be the GitLab instance (HTTPS, token sent
+## as an extra header passed to git through its environment, so it is neither stored
+## in the mirror nor visible in the process list; needs git 2.31+) or any git
+## URL/path template, e.g. local fixture repos for offline runs.
+import os
+import base64
+import shutil
+import pathlib
+import subprocess
+
+DEFAULT_MIRROR_DIR  = "~/.cache/query_gitlab/mirrors"
+DEFAULT_SOURCE      = "{base_url}/{path}.git"   ## {base_url} and {path} are filled in
+MIRROR_FILTER       = "blob:none"               ## commits (and trees) only
+HEADS_REFSPEC       = "+refs/heads/*:refs/heads/*"
+BRANCH_DATE_FORMAT  = "%(refname:lstrip=2)%00%(committerdate:iso-strict)"
+
+class MirrorError(Exception):
+    pass
+
+def run_git(git_args, cwd=None, token=None):
+    env = dict(os.environ, GIT_TERMINAL_PROMPT="0")
+    if token:
+        ## GitLab accepts a token as the password of any user over HTTPS; passed as
+        ## GIT_CONFIG_KEY_n/VALUE_n (after any the caller set), not "-c" in argv
+        credentials = base64.b64encode(("oauth2:%s" % (token)).encode()).decode()
+        config_index = int(env.get("GIT_CONFIG_COUNT") or 0)
+        env["GIT_CONFIG_KEY_%d" % (config_index)] = "http.extraHeader"
+        env["GIT_CONFIG_VALUE_%d" % (config_index)] = "Authorization: Basic %s" % (credentials)
+        env["GIT_CONFIG_COUNT"] = str(config_index + 1)
+    result = subprocess.run(
+        ["git"] + git_args, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+        env=env)
+    if result.returncode != 0:
+        raise MirrorError("git %s failed: %s" % (git_args[0], result.stderr.strip()))
+    return result.stdout
+
+def source_url(template, base_url, project_path):
+    return template.format(base_url=base_url.rstrip("/"), path=project_path)
+
+def mirror_path(mirror_dir, project_path):
+    return pathlib.Path(mirror_dir).expanduser() / (project_path + ".git")
+
+def refresh_mirror(mirror_dir, project_path, source, token=None):
+    ## returns (mirror path, "cloned" or "fetched")
+    mirror = mirror_path(mirror_dir, project_path)
+    if mirror.is_dir():
+        run_git(["fetch", "--prune", "--quiet", "origin"], cwd=str(mirror), token=token)
+        return mirror, "fetched"
+    ## clone next to the final path and rename, so an interrupted clone is never used
+    mirror.parent.mkdir(parents=True, exist_ok=True)
+    temp_mirror = mirror.with_name(mirror.name + ".tmp%d" % (os.getpid()))
+    try:
+        run_git(
+            ["clone", "--bare", "--quiet", "--no-tags", "--filter=%s" % (MIRROR_FILTER), source, str(temp_mirror)],
+            token=token)
+        run_git(["config", "remote.origin.fetch", HEADS_REFSPEC], cwd=str(temp_mirror))
+        os.rename(temp_mirror, mirror)
+    finally:
+        if temp_mirror.exists():
+            shutil.rmtree(temp_mirror, ignore_errors=True)
+    return mirror, "cloned"
+
+def branch_dates(mirror):
+    ## [(branch name, committer date)] for every branch, from one for-each-ref call
+    output = run_git(["for-each-ref", "--format=%s" % (BRANCH_DATE_FORMAT), "refs/heads"], cwd=str(mirror))
+    return [tuple(line.split("\0", 1)) for line in output.splitlines() if "\0" in line]
+
+def default_branch(mirror):
+    try:
+        return run_git(["symbolic-ref", "--short", "HEAD"], cwd=str(mirror)).strip() or None
+    except MirrorError:
+        return None
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+## Compact plan storage and plan file converters used by query_gitlab.py
+##
+## A plan database (.sqlite/.db) stores each project path once and its branches in a
+## table clustered by (project, branch), so one project's branches can be read
+## directly and the whole plan streamed project by project in sorted order without
+## loading it.  YAML goes through the libyaml C loader/dumper when PyYAML was built
+## with it.  Converting between layouts:
+##   python gitlab_plan.py plan.yaml plan.sqlite
+import os
+import sys
+import json
+import heapq
+import sqlite3
+import tempfile
+import itertools
+import lazy_modules
+
+yaml = lazy_modules.lazy_import("yaml")
+
+PLAN_DB_EXTENSIONS  = ["sqlite", "db"]
+PLAN_STREAM_EXTENSIONS  = ["jsonl", "ndjson"]
+COMMIT_INTERVAL     = 1000          ## rows written between commits while scanning
+SORT_CHUNK_RECORDS  = 100000        ## JSONL records sorted in memory at a time
+
+## YAML classes; None picks libyaml (C) when available, several times faster than the
+## pure-Python classes (looked up on use, so importing this module does not load PyYAML)
+YAML_LOADER = None
+YAML_DUMPER = None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS plan_projects (
+    id          INTEGER PRIMARY KEY,
+    path        TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS plan_branches (
+    project_id      INTEGER NOT NULL,
+    branch          TEXT NOT NULL,
+    committed_date  TEXT NOT NULL,
+    PRIMARY KEY (project_id, branch)
+) WITHOUT ROWID;
+"""
+
+def yaml_loader():
+    return YAML_LOADER or getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+def yaml_dumper():
+    return YAML_DUMPER or getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+def file_extension(fname):
+    return fname.lower().split(".")[-1]
+
+def is_plan_db(fname):
+    return file_extension(fname) in PLAN_DB_EXTENSIONS
+
+class PlanDatabase:
+    def __init__(self, filepath, mode="r"):
+        ## mode "r" opens an existing plan, "w" starts a new (empty) one
+        if mode == "w":
+            if os.path.exists(filepath):
+                os.remove(filepath)
+        elif not os.path.isfile(filepath):
+            raise FileNotFoundError(filepath)
+        self.filepath = filepath
+        self.connection = sqlite3.connect(filepath, check_same_thread=False)
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.executescript(SCHEMA)
+        self.project_ids = {}
+        self.pending_rows = 0
+
+    def project_id(self, project_path):
+        project_id = self.project_ids.get(project_path)
+        if project_id is None:
+            row = self.connection.execute("SELECT id FROM plan_projects WHERE path = ?", (project_path,)).fetchone()
+            if row is None:
+                project_id = self.connection.execute(
+                    "INSERT INTO plan_projects (path) VALUES (?)", (project_path,)).lastrowid
+            else:
+                project_id = row[0]
+            self.project_ids[project_path] = project_id
+        return project_id
+
+    def add(self, project_path, branch_name, committed_date):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO plan_branches (project_id, branch, committed_date) VALUES (?, ?, ?)",
+            (self.project_id(project_path), branch_name, committed_date))
+        self.pending_rows += 1
+        if self.pending_rows >= COMMIT_INTERVAL:
+            self.commit()
+
+    def commit(self):
+        self.connection.commit()
+        self.pending_rows = 0
+
+    def count(self):
+        return self.connection.execute("SELECT COUNT(*) FROM plan_branches").fetchone()[0]
+
+    def projects(self):
+        return [row[0] for row in self.connection.execute("SELECT path FROM plan_projects ORDER BY path")]
+
+    def project_branches(self, project_path):
+        ## {branch: committed_date} of one project (empty if it is not in the plan)
+        return dict(self.connection.execute(
+            "SELECT b.branch, b.committed_date FROM plan_branches b JOIN plan_projects p ON p.id = b.project_id "
+            "WHERE p.path = ? ORDER BY b.branch", (project_path,)))
+
+    def iter_records(self):
+        ## (project, branch, committed_date), sorted by project and branch
+        return self.connection.execute(
+            "SELECT p.path, b.branch, b.committed_date FROM plan_projects p "
+            "JOIN plan_branches b ON b.project_id = p.id ORDER BY p.path, b.branch")
+
+    def iter_projects(self):
+        ## (project, {branch: committed_date}) one project at a time
+        for project_path, records in itertools.groupby(self.iter_records(), key=lambda record: record[0]):
+            yield project_path, {branch_name: committed_date for _, branch_name, committed_date in records}
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+
+def iter_jsonl_records(fname):
+    ## (project, branch, committed_date) one line at a time; a truncated last line
+    ## (scan interrupted mid-write) or any other invalid line is skipped with a warning
+    with open(fname, "r") as file:
+        for line_number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                yield record["project"], record["branch"], record["committed_date"]
+            except (json.JSONDecodeError, KeyError, TypeError):
+                print(f"WARNING: skipping invalid plan line %d in %r" % (line_number, fname))
+
+def plan_record_key(record):
+    return record[0], record[1]
+
+def iter_sorted_jsonl_records(fname, chunk_records=SORT_CHUNK_RECORDS):
+    ## JSONL records sorted by project and branch, whatever order they were written in
+    ## (concurrent scans interleave projects); a branch listed twice keeps its last
+    ## date.  Memory is bounded: past chunk_records records, sorted runs are spilled to
+    ## temporary files and merged.
+    records = iter_jsonl_records(fname)
+    run_files = []
+    try:
+        chunk = sorted(itertools.islice(records, chunk_records), key=plan_record_key)
+        next_chunk = sorted(itertools.islice(records, chunk_records), key=plan_record_key)
+        if not next_chunk:
+            merged_records = chunk
+        else:
+            while chunk:
+                run_file = tempfile.TemporaryFile("w+")
+                run_file.writelines(json.dumps(each_record) + "\n" for each_record in chunk)
+                run_file.seek(0)
+                run_files.append(run_file)
+                chunk, next_chunk = next_chunk, sorted(itertools.islice(records, chunk_records), key=plan_record_key)
+            ## (heapq.merge is stable, so equal keys keep the order they were written in)
+            merged_records = heapq.merge(
+                *((tuple(json.loads(line)) for line in run_file) for run_file in run_files), key=plan_record_key)
+        for _, same_records in itertools.groupby(merged_records, key=plan_record_key):
+            for each_record in same_records:
+                pass
+            yield each_record
+    finally:
+        for run_file in run_files:
+            run_file.close()
+
+def is_sorted_jsonl_plan(fname):
+    ## whether a JSONL plan is already sorted by project and branch, each branch listed
+    ## once, so that it can be read as is
+    previous_key = None
+    for each_record in iter_jsonl_records(fname):
+        record_key = plan_record_key(each_record)
+        if previous_key is not None and record_key <= previous_key:
+            return False
+        previous_key = record_key
+    return True
+
+def sort_jsonl_plan(fname):
+    ## rewrites a JSONL plan sorted by project and branch (through a temporary file)
+    temp_fname = os.path.join(os.path.dirname(fname), ".tmp." + os.path.basename(fname))
+    write_plan(temp_fname, iter_sorted_jsonl_records(fname))
+    os.replace(temp_fname, fname)
+
+def iter_plan_records(fname):
+    ## (project, branch, committed_date) from a plan in any supported layout
+    fext = file_extension(fname)
+    if fext in PLAN_DB_EXTENSIONS:
+        plan_db = PlanDatabase(fname)
+        try:
+            for each_record in plan_db.iter_records():
+                yield tuple(each_record)
+        finally:
+            plan_db.close()
+        return
+    if fext in PLAN_STREAM_EXTENSIONS:
+        yield from iter_jsonl_records(fname)
+        return
+    with open(fname, "r") as file:
+        if fext in ["yaml", "yml"]:
+            plan_data = yaml.load(file, Loader=yaml_loader())
+        else:
+            plan_data = json.load(file)
+    for project_path, project_branches in (plan_data or {}).items():
+        for branch_name, committed_date in project_branches.items():
+            yield project_path, branch_name, committed_date
+
+def write_plan(fname, records):
+    ## writes (project, branch, committed_date) records in the layout of the file extension
+    fext = file_extension(fname)
+    if fext in PLAN_DB_EXTENSIONS:
+        plan_db = PlanDatabase(fname, "w")
+        for project_path, branch_name, committed_date in records:
+            plan_db.add(project_path, branch_name, committed_date)
+        plan_db.close()
+        return
+    with open(fname, "w") as file:
+        if fext in PLAN_STREAM_EXTENSIONS:
+            for project_path, branch_name, committed_date in records:
+                file.write(json.dumps({"project": project_path, "branch": branch_name, "committed_date": committed_date}) + "\n")
+            return
+        plan_data = {}
+        for project_path, branch_name, committed_date in records:
+            plan_data.setdefault(project_path, {})[branch_name] = committed_date
+        if fext in ["yaml", "yml"]:
+            yaml.dump(plan_data, file, Dumper=yaml_dumper())
+        else:
+            json.dump(plan_data, file)
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("usage: %s INFILE OUTFILE  (.yaml/.yml, .json, .jsonl/.ndjson, .sqlite/.db)" % (sys.argv[0]))
+        sys.exit(2)
+    write_plan(sys.argv[2], iter_plan_records(sys.argv[1]))
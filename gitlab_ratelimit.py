@@ -0,0 +1,134 @@
+## Adaptive concurrency limiter and throughput counter used by query_gitlab.py
+##
+## Workers take a permit before each API call.  Every response seen on the session is
+## fed back: HTTP 429 halves the number of permits and pauses all workers until
+## Retry-After has passed; successful responses grow the permits back one step at a
+## time (additive increase / multiplicative decrease), holding steady while GitLab's
+## RateLimit-Remaining header says the budget is nearly spent.
+import sys
+import time
+import threading
+
+DEFAULT_BACKOFF     = 1.0           ## seconds to pause after a 429 without Retry-After
+MAX_BACKOFF         = 60.0
+PROGRESS_INTERVAL   = 0.5           ## seconds between live counter updates (terminal)
+PROGRESS_LOG_INTERVAL = 10.0        ## seconds between counter lines (non-terminal)
+
+def parse_retry_after(value):
+    ## Retry-After is either a number of seconds or an HTTP date
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    ## (an HTTP date is rare; email.utils is slow to import)
+    import email.utils
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class AdaptiveLimiter:
+    def __init__(self, max_concurrency, min_concurrency=1):
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.concurrency = float(self.max_concurrency)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.backoff = DEFAULT_BACKOFF
+        self.throttled = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                pause = self.paused_until - time.monotonic()
+                if pause > 0:
+                    self.condition.wait(pause)
+                elif self.in_flight < int(self.concurrency):
+                    break
+                else:
+                    self.condition.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def observe(self, status_code, headers):
+        with self.condition:
+            if status_code == 429:
+                self.throttled += 1
+                retry_after = parse_retry_after(headers.get("Retry-After"))
+                if retry_after is None:
+                    retry_after = self.backoff
+                    self.backoff = min(MAX_BACKOFF, self.backoff * 2)
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+                self.concurrency = max(self.min_concurrency, self.concurrency / 2)
+            else:
+                self.backoff = DEFAULT_BACKOFF
+                remaining = headers.get("RateLimit-Remaining")
+                if remaining is not None and remaining.isdigit() and int(remaining) <= self.max_concurrency:
+                    ## close to the server's budget: stop growing until it resets
+                    pass
+                else:
+                    self.concurrency = min(self.max_concurrency, self.concurrency + 1.0 / self.concurrency)
+            self.condition.notify_all()
+
+    def response_hook(self, response, *args, **kwargs):
+        ## requests session hook: session.hooks["response"].append(limiter.response_hook)
+        self.observe(response.status_code, response.headers)
+
+class ThroughputCounter:
+    def __init__(self, label, total=None, stream=sys.stderr, limiter=None):
+        self.label = label
+        self.total = total
+        self.stream = stream
+        self.limiter = limiter
+        self.done = 0
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.last_shown = 0.0
+        self.interactive = hasattr(stream, "isatty") and stream.isatty()
+
+    def format(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        if self.total is not None:
+            progress = "%d/%d" % (self.done, self.total)
+        else:
+            progress = "%d" % (self.done)
+        line = "INFO: %s %s (%.1f/s" % (self.label, progress, self.done / elapsed)
+        if self.limiter is not None:
+            line += ", concurrency %d, throttled %d" % (int(self.limiter.concurrency), self.limiter.throttled)
+        return line + ")"
+
+    def update(self, count=1):
+        with self.lock:
+            self.done += count
+            now = time.monotonic()
+            interval = PROGRESS_INTERVAL if self.interactive else PROGRESS_LOG_INTERVAL
+            if now - self.last_shown < interval:
+                return
+            self.last_shown = now
+            if self.interactive:
+                self.stream.write("\r" + self.format())
+            else:
+                self.stream.write(self.format() + "\n")
+            self.stream.flush()
+
+    def finish(self):
+        with self.lock:
+            if self.interactive:
+                self.stream.write("\r" + self.format() + "\n")
+            else:
+                self.stream.write(self.format() + "\n")
+            self.stream.flush()
@@ -0,0 +1,121 @@
+## Scheduler/daemon mode used by query_gitlab.py ("serve" action)
+##
+## Runs a scan callable (returning the plan {project: {branch: committed_date}}) on a
+## fixed interval in the main thread, keeping whatever client and cache it uses warm
+## between runs, and serves the latest result over a local HTTP endpoint:
+##   GET  /plan[?project=PATH]    latest plan (optionally one project) as JSON
+##   GET  /status                 time, duration, count and error of the latest scan
+##   POST /scan                   start a new scan now (answers 202 immediately)
+import json
+import threading
+import time
+import traceback
+import urllib.parse
+
+DEFAULT_LISTEN      = "127.0.0.1:8765"
+DEFAULT_INTERVAL    = 900           ## seconds between scheduled scans
+
+class PlanService:
+    def __init__(self, scan, interval=DEFAULT_INTERVAL):
+        self.scan = scan
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.plan = None
+        self.status = {"scans": 0, "scanning": False, "scanned_at": None, "duration_s": None, "error": None}
+
+    def run_scan(self):
+        with self.lock:
+            self.status["scanning"] = True
+        started = time.monotonic()
+        try:
+            plan = self.scan()
+            error = None
+        except Exception as e:
+            traceback.print_exc()
+            plan = None
+            error = "%s: %s" % (type(e).__name__, e)
+        with self.lock:
+            if plan is not None:
+                self.plan = plan
+            self.status.update(
+                scans=self.status["scans"] + 1,
+                scanning=False,
+                scanned_at=time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                duration_s=round(time.monotonic() - started, 3),
+                error=error)
+
+    def run_forever(self):
+        ## scheduled scans; POST /scan wakes the loop early
+        while True:
+            self.run_scan()
+            self.wake.wait(self.interval)
+            self.wake.clear()
+
+    def snapshot(self, project=None):
+        with self.lock:
+            if self.plan is None:
+                return None
+            if project is not None:
+                return {project: self.plan.get(project, {})}
+            return self.plan
+
+    def snapshot_status(self):
+        with self.lock:
+            return dict(self.status, interval_s=self.interval)
+
+def make_handler(service):
+    ## (http.server is imported here: it is slow to import, and only "serve" needs it)
+    from http.server import BaseHTTPRequestHandler
+
+    class PlanHandler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, status_code, body):
+            data = json.dumps(body).encode()
+            self.send_response(status_code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urllib.parse.urlparse(self.path)
+            if url.path == "/status":
+                return self.send_json(200, service.snapshot_status())
+            if url.path == "/plan":
+                project = urllib.parse.parse_qs(url.query).get("project", [None])[0]
+                plan = service.snapshot(project)
+                if plan is None:
+                    return self.send_json(503, {"message": "first scan has not finished yet"})
+                return self.send_json(200, plan)
+            return self.send_json(404, {"message": "not found: use /plan, /status or POST /scan"})
+
+        def do_POST(self):
+            if urllib.parse.urlparse(self.path).path != "/scan":
+                return self.send_json(404, {"message": "not found: use /plan, /status or POST /scan"})
+            service.wake.set()
+            return self.send_json(202, {"message": "scan requested"})
+
+    return PlanHandler
+
+def parse_listen(listen):
+    ## "HOST:PORT" or ":PORT" (localhost)
+    host, _, port = listen.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+def serve(scan, listen=DEFAULT_LISTEN, interval=DEFAULT_INTERVAL):
+    from http.server import ThreadingHTTPServer
+    service = PlanService(scan, interval)
+    server = ThreadingHTTPServer(parse_listen(listen), make_handler(service))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"INFO: serving plans on http://%s:%d/plan (scan every %ds)" % (
+        server.server_address[0], server.server_address[1], interval))
+    try:
+        service.run_forever()
+    except KeyboardInterrupt:
+        print(f"INFO: stopping")
+    finally:
+        server.shutdown()
@@ -0,0 +1,134 @@
+## Request-level instrumentation used by query_gitlab.py ("--stats")
+##
+## Every API response (python-gitlab/requests session hook, or the async client) is
+## recorded per endpoint: call count, latency samples (reported as p50/p95/p99), bytes
+## received/sent and retries (429 and 5xx responses, which the clients retry).  Named
+## phases (resolve, scan, delete, ...) accumulate wall time.  The summary is printed as
+## a table or written as JSON.
+import re
+import sys
+import json
+import time
+import threading
+import contextlib
+import urllib.parse
+
+PERCENTILES         = [50, 95, 99]
+
+## collapse ids, paths and branch names so calls group by endpoint
+ENDPOINT_PATTERNS   = [
+    (re.compile(r"^/api/v4"), ""),
+    (re.compile(r"^/(projects|groups)/[^/]+"), r"/\1/:id"),
+    (re.compile(r"/repository/branches/.+$"), "/repository/branches/:name"),
+]
+
+def endpoint_key(method, url):
+    path = urllib.parse.urlsplit(str(url)).path
+    for pattern, replacement in ENDPOINT_PATTERNS:
+        path = pattern.sub(replacement, path)
+    return "%s %s" % (method.upper(), path)
+
+def percentile(sorted_samples, percent):
+    ## nearest-rank percentile of an already sorted list
+    if not sorted_samples:
+        return 0.0
+    rank = max(1, -(-len(sorted_samples) * percent // 100))
+    return sorted_samples[int(rank) - 1]
+
+class RequestStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.endpoints = {}
+        self.phases = {}
+
+    def record(self, method, url, status_code, seconds, bytes_received=0, bytes_sent=0):
+        key = endpoint_key(method, url)
+        with self.lock:
+            endpoint = self.endpoints.get(key)
+            if endpoint is None:
+                endpoint = {"calls": 0, "latencies": [], "bytes_received": 0, "bytes_sent": 0, "retries": 0, "errors": 0}
+                self.endpoints[key] = endpoint
+            endpoint["calls"] += 1
+            endpoint["latencies"].append(seconds)
+            endpoint["bytes_received"] += bytes_received
+            endpoint["bytes_sent"] += bytes_sent
+            if status_code == 429 or status_code >= 500:
+                endpoint["retries"] += 1
+            elif status_code >= 400:
+                endpoint["errors"] += 1
+
+    def response_hook(self, response, *args, **kwargs):
+        ## requests session hook: session.hooks["response"].append(stats.response_hook)
+        content_length = response.headers.get("Content-Length")
+        if content_length is not None and content_length.isdigit():
+            bytes_received = int(content_length)
+        else:
+            bytes_received = len(response.content or b"")
+        request_body = response.request.body or b""
+        self.record(
+            response.request.method, response.url, response.status_code,
+            response.elapsed.total_seconds(), bytes_received, len(request_body))
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0.0) + time.monotonic() - started
+
+    def summary(self):
+        with self.lock:
+            endpoints = {}
+            for key in sorted(self.endpoints):
+                endpoint = self.endpoints[key]
+                latencies = sorted(endpoint["latencies"])
+                endpoints[key] = {
+                    "calls": endpoint["calls"],
+                    "retries": endpoint["retries"],
+                    "errors": endpoint["errors"],
+                    "bytes_received": endpoint["bytes_received"],
+                    "bytes_sent": endpoint["bytes_sent"],
+                    "latency_total_s": round(sum(latencies), 6),
+                }
+                for each_percent in PERCENTILES:
+                    endpoints[key]["latency_p%d_ms" % (each_percent)] = round(percentile(latencies, each_percent) * 1000, 3)
+            return {
+                "wall_time_s": round(time.monotonic() - self.started, 6),
+                "phases_s": {name: round(seconds, 6) for name, seconds in self.phases.items()},
+                "totals": {
+                    "calls": sum(endpoint["calls"] for endpoint in endpoints.values()),
+                    "retries": sum(endpoint["retries"] for endpoint in endpoints.values()),
+                    "errors": sum(endpoint["errors"] for endpoint in endpoints.values()),
+                    "bytes_received": sum(endpoint["bytes_received"] for endpoint in endpoints.values()),
+                    "bytes_sent": sum(endpoint["bytes_sent"] for endpoint in endpoints.values()),
+                },
+                "endpoints": endpoints,
+            }
+
+    def print_table(self, stream=sys.stdout):
+        summary = self.summary()
+        key_width = max([len("endpoint")] + [len(key) for key in summary["endpoints"]])
+        row_format = "%-" + str(key_width) + "s %7s %7s %6s %9s %9s %9s %11s"
+        stream.write("STATS: API requests\n")
+        stream.write(row_format % ("endpoint", "calls", "retries", "errors", "p50 ms", "p95 ms", "p99 ms", "KiB recv") + "\n")
+        for key, endpoint in summary["endpoints"].items():
+            stream.write(row_format % (
+                key, endpoint["calls"], endpoint["retries"], endpoint["errors"],
+                "%.1f" % (endpoint["latency_p50_ms"]),
+                "%.1f" % (endpoint["latency_p95_ms"]),
+                "%.1f" % (endpoint["latency_p99_ms"]),
+                "%.1f" % (endpoint["bytes_received"] / 1024.0)) + "\n")
+        totals = summary["totals"]
+        stream.write(row_format % (
+            "total", totals["calls"], totals["retries"], totals["errors"], "", "", "",
+            "%.1f" % (totals["bytes_received"] / 1024.0)) + "\n")
+        stream.write("STATS: wall time %.2fs (%s)\n" % (
+            summary["wall_time_s"],
+            ", ".join("%s %.2fs" % (name, seconds) for name, seconds in summary["phases_s"].items()) or "no phases"))
+
+    def write_json(self, filepath):
+        with open(filepath, "w") as file:
+            json.dump(self.summary(), file, indent=2)
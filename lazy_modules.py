@@ -0,0 +1,33 @@
+## Deferred imports shared by query_gitlab.py and its gitlab_* modules
+##
+## lazy_import("name") registers a module that is only executed on first attribute
+## access, so "--help" and plans read from a file never pay for python-gitlab/requests,
+## PyYAML, asyncio or httpx.  Every module that wants the deferral must get the module
+## through lazy_import: a plain "import name" statement loads it right away (the
+## import system reads its __spec__).  The first attribute access must happen in the
+## main thread (LazyLoader is not thread-safe before Python 3.12).  A required
+## module that is not installed fails at once, as a plain import would; only
+## optional=True modules (httpx, h2) come back as None.
+import sys
+import importlib.util
+
+def lazy_import(name, optional=False):
+    ## returns the (possibly not yet loaded) module; raises ModuleNotFoundError if it
+    ## is not installed, or returns None for an optional module
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        if optional:
+            return None
+        raise ModuleNotFoundError("No module named %r" % (name), name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    if "." in name:
+        ## find_spec imported the parent package; "package.module" needs the attribute
+        parent_name, _, child_name = name.rpartition(".")
+        setattr(sys.modules[parent_name], child_name, module)
+    return module
@@ -1,16 +1,43 @@
 #!/Users/bmsnook/github/shared-scratch/.venv/bin/python
 
-## pip install python-gitlab
-##   https://python-gitlab.readthedocs.io/en/stable/
-import gitlab
 import pathlib
 import argparse
 import os
 import sys
-import yaml
 import json
+import threading
+import time
+import itertools
+import contextlib
+import atexit
+import concurrent
+## custom module to defer heavy imports until first use (fast "--help" and plan-file paths)
+import lazy_modules
+
+## pip install python-gitlab
+##   https://python-gitlab.readthedocs.io/en/stable/
+gitlab = lazy_modules.lazy_import("gitlab")
+yaml = lazy_modules.lazy_import("yaml")
+asyncio = lazy_modules.lazy_import("asyncio")
+lazy_modules.lazy_import("concurrent.futures")
 ## custom module to process various datetime string formats and compare values
 import date_compare
+## custom module for batched GraphQL branch queries ("--backend graphql")
+import gitlab_graphql
+## custom module for the on-disk project/branch metadata cache ("--cache")
+import gitlab_cache
+## custom module to adapt concurrency to GitLab rate limits and report throughput
+import gitlab_ratelimit
+## custom module with an asyncio REST client ("--backend async")
+import gitlab_async
+## custom module for request-level instrumentation ("--stats")
+import gitlab_stats
+## custom module for the scheduler/daemon mode ("serve")
+import gitlab_serve
+## custom module for local bare mirrors ("--backend git-mirror")
+import gitlab_mirror
+## custom module for the compact (SQLite) plan format and plan file converters
+import gitlab_plan
 
 ## 
 ## GLOBAL VARIABLES - intended to be static defaults
@@ -20,6 +47,13 @@ PRIVATE_TOKEN_FILE  = "~/.gittoken"
 PROTECTED_BRANCHES  = ["master", "main"]
 DEFAULT_COMMIT_AGE_MONTHS_THRESHOLD = 3
 DEFAULT_OUTPUT_FORMAT   = "yaml"        ## set to "yaml" or "json"
+DEFAULT_WORKERS     = 1             ## concurrent API workers (1 = sequential scan)
+BRANCH_PAGE_SIZE    = 100           ## branches per listing request (API maximum)
+## GitLab leaves out the page count of listings over 10000 items
+UNCOUNTED_PAGES     = 10000 // BRANCH_PAGE_SIZE
+DEFAULT_BACKEND     = "rest"        ## set to "rest", "graphql", "async" or "git-mirror"
+JOURNAL_SUFFIX      = ".journal"    ## default apply journal: <plan file>.journal
+JOURNAL_DONE_OUTCOMES   = ["deleted", "not_found"]  ## skipped by --resume
 
 ## Defaults for Python Gitlab API Module
 ##   CHANGE to appropriate values for your environment
@@ -44,22 +78,72 @@ projects_expire_plan = {}
 plan_branches_not_found = {}
 plan_branches_not_deleted = {}
 output_format = DEFAULT_OUTPUT_FORMAT
+gitlab_base_url = GITLAB_BASE_URL
+commit_age_months_threshold = DEFAULT_COMMIT_AGE_MONTHS_THRESHOLD
+## "now" and the commit age cutoff, fixed when a scan starts (set by plan_branches())
+age_cutoff = None
+## report action: age buckets of the scan and {project path: [branches per bucket]},
+## counted while scanning (set by main())
+age_buckets = None
+branch_age_counts = None
+## client and settings shared by all API calls, set by connect()
+gl = None
+gitlab_access_token = None
+api_limiter = None
+num_workers = DEFAULT_WORKERS
+num_async_requests = gitlab_async.DEFAULT_CONCURRENCY
+scan_backend = DEFAULT_BACKEND
+metadata_cache = None
 plan_filename = None
+## open JSONL/SQLite plan that branches are written to as they are found, and the 
+## JSONL/SQLite plan file read back lazily instead of projects_expire_plan (read as
+## is once it is known to be sorted)
+plan_stream = None
+plan_stream_file = None
+plan_stream_sorted = False
+request_stats = None
+## append-only journal of apply outcomes, and the branches it records as done
+apply_journal = None
+journal_lock = threading.Lock()
+journal_done = set()
+## guards projects_expire_plan (or the plan stream) and the scan counters when they are
+## updated from worker threads
+plan_lock = threading.Lock()
+scan_request_counts = {}
 
 
 ## Accept arguments to override default behavior
 parser = argparse.ArgumentParser(description="Expire branches with old last commits (default 3 months) in projects (defaults: apps, gcp-terraform)")
 parser.add_argument("-p", "--project", action="append", type=str, help="project repo(s) to check (flag/arg can be repeated)")
+parser.add_argument("-g", "--group", action="append", type=str, help="group(s) whose projects are all checked (flag/arg can be repeated)")
+parser.add_argument("--include-subgroups", action="store_true", help="with --group, also check projects in subgroups")
 parser.add_argument("-m", "--months", type=int, help="number of months for expiration (default: 3)")
 parser.add_argument("-t", "--tokenpath", type=str, help="path to gitlab token file (default: ~/.gittoken; overrides env CI_JOB_TOKEN if set)")
-parser.add_argument("--infile", type=str, help="plan file to read from")
-parser.add_argument("--outfile", type=str, help="plan file to save to")
+parser.add_argument("--infile", type=str, help="plan file to read from (.jsonl and .sqlite plans are read lazily)")
+parser.add_argument("--outfile", type=str, help="plan file to save to (.jsonl and .sqlite plans are written as branches are found)")
 parser.add_argument("-f", "--format", type=str, help="format to use for plan display (yaml or json)")
+parser.add_argument("-u", "--url", type=str, help="GitLab base URL (default: %s)" % (GITLAB_BASE_URL))
+parser.add_argument("-b", "--backend", type=str, choices=['rest', 'graphql', 'async', 'git-mirror'], help="API used to scan branches; 'async' also deletes over a pooled asyncio client, 'git-mirror' reads local bare mirrors (default: rest)")
+parser.add_argument("--graphql-batch", type=int, help="projects or branches per GraphQL query (default: %d)" % (gitlab_graphql.DEFAULT_BATCH_SIZE))
+parser.add_argument("--cache", nargs="?", const=gitlab_cache.DEFAULT_CACHE_FILE, type=str, help="cache project and branch metadata on disk (rest backend only; default file: %s)" % (gitlab_cache.DEFAULT_CACHE_FILE))
+parser.add_argument("--cache-ttl", type=int, help="seconds before cached metadata is revalidated (default: %d)" % (gitlab_cache.DEFAULT_TTL))
+parser.add_argument("--ordered-scan", action="store_true", help="list branches oldest first and stop at the first one newer than the threshold (rest and async backends)")
+parser.add_argument("--mirror-dir", type=str, help="with git-mirror, directory holding the bare mirrors (default: %s)" % (gitlab_mirror.DEFAULT_MIRROR_DIR))
+parser.add_argument("--mirror-source", type=str, help="with git-mirror, git URL/path template to mirror from, e.g. /srv/fixtures/{path}.git; no API access is needed (default: %s)" % (gitlab_mirror.DEFAULT_SOURCE))
+parser.add_argument("-w", "--workers", type=int, help="number of concurrent workers for scanning and deleting branches (default: 1; async backend: requests in flight, default %d)" % (gitlab_async.DEFAULT_CONCURRENCY))
+parser.add_argument("--journal", type=str, help="apply journal recording each branch's outcome (default: <plan file>%s)" % (JOURNAL_SUFFIX))
+parser.add_argument("--resume", action="store_true", help="with apply, skip branches the journal records as deleted or not found")
+parser.add_argument("--stats", action="store_true", help="record every API request and print a summary table at exit")
+parser.add_argument("--stats-file", type=str, help="write the request statistics as JSON to this file at exit (implies --stats)")
 parser.add_argument("-d", "--debug", action="store_true", help="enable debug output")
 parser.add_argument("-v", "--verbose", action="store_true", help="enable verbose output")
-parser.add_argument("action", type=str, choices=['plan', 'validate', 'apply'], help="Action to perform (plan or apply)")
-## Read arguments from command line
-args = parser.parse_args()
+parser.add_argument("--age-buckets", type=str, help="with report, comma separated bucket boundaries in months (default: %s); a report scans and counts every unprotected branch, but with --infile it counts only the branches in that plan, i.e. the stale ones" % (",".join(str(each_months) for each_months in date_compare.DEFAULT_AGE_BUCKETS)))
+parser.add_argument("--listen", type=str, help="with serve (rest backend only), HOST:PORT to serve plans on (default: %s)" % (gitlab_serve.DEFAULT_LISTEN))
+parser.add_argument("--interval", type=int, help="with serve, seconds between scans (default: %d)" % (gitlab_serve.DEFAULT_INTERVAL))
+parser.add_argument("action", type=str, choices=['plan', 'validate', 'apply', 'serve', 'report'], help="Action to perform (plan, validate, apply, serve plans over HTTP, or report branches by age; see --age-buckets)")
+## Library defaults (see connect() and plan_branches()); main() replaces them with the 
+## command line arguments
+args = parser.parse_args(["plan"])
 
 
 ## 
@@ -109,7 +193,7 @@ def get_group_id(target_group):
         # print(f"DEBUG: return: %r => %r" % (g.id, g.full_path))
         return g.id
     
-def get_project_id(target_project):
+def expand_project_identifier(target_project):
     try:
         tp = int(target_project)
     except:
@@ -122,99 +206,560 @@ def get_project_id(target_project):
         else:
             # pass
             tp = target_project.strip("/")
+    return tp
 
+def resolve_project(target_project):
+    ## returns (id, path_with_namespace), from the metadata cache when enabled
+    tp = expand_project_identifier(target_project)
     try:
-        if args.debug: print(f"DEBUG: p = gl.projects.get(%r)" % (tp))
-        p = gl.projects.get(tp)
+        if metadata_cache is not None:
+            if args.debug: print(f"DEBUG: cached_project(%r)" % (tp))
+            project_id, project_path = gitlab_cache.cached_project(metadata_cache, gl, tp)
+        else:
+            if args.debug: print(f"DEBUG: p = gl.projects.get(%r)" % (tp))
+            p = gl.projects.get(tp)
+            project_id, project_path = p.id, p.path_with_namespace
     except:
         print(f"ERROR: could not find project %r => %r" % (target_project, tp))
-        return 1    
+        return None
     else:
-        if args.debug: print(f"DEBUG: return: %r => %r" % (p.id, p.path_with_namespace))
-        return p.id
+        if args.debug: print(f"DEBUG: return: %r => %r" % (project_id, project_path))
+        return project_id, project_path
 
-def get_project_path(target_project):
-    try:
-        tp = int(target_project)
-    except:
-        ## split path parts while removing any trailing slash
-        t_parts = target_project.strip("/").split("/")
-        if len(t_parts) < 2:
-            tp = DEFAULT_GL_GROUP_PATH + "/" + target_project
-        elif len(t_parts) < 3:
-            tp = DEFAULT_GL_NAMESPACE + "/" + target_project
-        else:
-            # pass
-            tp = target_project.strip("/")
+def get_project_id(target_project):
+    resolved_project = resolve_project(target_project)
+    if resolved_project is None:
+        return 1
+    return resolved_project[0]
 
-    try:
-        if args.debug: print(f"DEBUG: p = gl.projects.get(%r)" % (tp))
-        p = gl.projects.get(tp)
-    except:
-        print(f"ERROR: could not find project %r => %r" % (target_project, tp))
-        return 1    
-    else:
-        if args.debug: print(f"DEBUG: return: %r => %r" % (p.id, p.path_with_namespace))
-        return p.path_with_namespace
+def get_project_path(target_project):
+    resolved_project = resolve_project(target_project)
+    if resolved_project is None:
+        return 1
+    return resolved_project[1]
     
 def register_branch_to_expire(exp_project, exp_branch, exp_date):
     global projects_expire_plan
-    target_project = projects_expire_plan.get(exp_project)
-    # if exp_project in projects_expire_plan:
-    if target_project is not None:
-        # print(f"DEBUG: found {exp_project}")
-        if exp_branch in target_project:
-            # print(f"\tDEBUG: found branch %r" % exp_branch)
-            projects_expire_plan[exp_project].update({exp_branch: exp_date})
+    with plan_lock:
+        if plan_stream is not None:
+            ## streaming plan: nothing is kept in memory, and every branch found so 
+            ## far survives a crash or timeout (up to the last commit for SQLite)
+            if isinstance(plan_stream, gitlab_plan.PlanDatabase):
+                plan_stream.add(exp_project, exp_branch, exp_date)
+            else:
+                plan_stream.write(json.dumps({"project": exp_project, "branch": exp_branch, "committed_date": exp_date}) + "\n")
+                plan_stream.flush()
+            return
+        target_project = projects_expire_plan.get(exp_project)
+        # if exp_project in projects_expire_plan:
+        if target_project is not None:
+            # print(f"DEBUG: found {exp_project}")
+            if exp_branch in target_project:
+                # print(f"\tDEBUG: found branch %r" % exp_branch)
+                projects_expire_plan[exp_project].update({exp_branch: exp_date})
+            else:
+                # print(f"\tDEBUG: did NOT find branch %r" % exp_branch)
+                projects_expire_plan[exp_project][exp_branch] = exp_date
         else:
-            # print(f"\tDEBUG: did NOT find branch %r" % exp_branch)
-            projects_expire_plan[exp_project][exp_branch] = exp_date
-    else:
-        # print(f"DEBUG: NOTFOUND: {exp_project}")
-        projects_expire_plan[exp_project] = {exp_branch: exp_date}
+            # print(f"DEBUG: NOTFOUND: {exp_project}")
+            projects_expire_plan[exp_project] = {exp_branch: exp_date}
 
-def find_stale_branches(input_projects):
+def sort_expire_plan():
+    ## rebuild the plan ordered by project and branch name so output does not depend 
+    ## on the order in which concurrent workers registered branches
+    global projects_expire_plan
+    with plan_lock:
+        projects_expire_plan = {
+            each_project: dict(sorted(projects_expire_plan[each_project].items()))
+            for each_project in sorted(projects_expire_plan)
+        }
+
+def get_protected_branch_names(query_project):
+    ## one listing per project; branch objects also carry their own "protected" flag,
+    ## which additionally covers wildcard protection rules
+    return {each_rule.name for each_rule in query_project.protectedbranches.list(get_all=True)}
+
+def reset_scan_request_counts():
+    global scan_request_counts
+    scan_request_counts = {"projects": 0, "branches": 0, "unprotected": 0, "requests": 0, "legacy_pages": 0}
+
+def count_scan_requests(num_requests, num_branches=0, num_unprotected=0, num_legacy_pages=0):
+    global scan_request_counts
+    with plan_lock:
+        scan_request_counts["requests"] += num_requests
+        scan_request_counts["branches"] += num_branches
+        scan_request_counts["unprotected"] += num_unprotected
+        scan_request_counts["legacy_pages"] += num_legacy_pages
+
+def check_branch_expiry(project_path, branch_name, committed_date, protected_names, branch_protected=False, date_stale=None):
+    ## returns None for a protected branch, else whether the branch was found stale;
+    ## date_stale is the date's classification when it was done in a batch
+    if branch_name in PROTECTED_BRANCHES or branch_name in protected_names or branch_protected:
+        # print(f"DEBUG: IGNORING %r" % (branch_name))
+        return None
+    if args.debug: print(f"DEBUG: PROCESSING branch %r last commit date %r" % (branch_name, committed_date))
+    if branch_age_counts is not None:
+        count_branch_age(project_path, committed_date)
+    if date_stale is None:
+        date_stale = age_cutoff.older_than(committed_date)
+    if date_stale:
+        if args.verbose: print(f"INFO: expiring %r branch %r last updated %r" % (
+            project_path, 
+            branch_name, 
+            committed_date))
+        register_branch_to_expire(project_path, branch_name, committed_date)
+        return True
+    return False
+
+def count_branch_age(project_path, committed_date):
+    ## report action: one more branch in its age bucket
+    bucket = age_buckets.bucket_of(committed_date)
+    with plan_lock:
+        project_counts = branch_age_counts.get(project_path)
+        if project_counts is None:
+            project_counts = branch_age_counts[project_path] = [0] * len(age_buckets.labels)
+        project_counts[bucket] += 1
+
+def scan_branch_records(project_path, branch_records, protected_names, stop_at_fresh=False):
+    ## branch listings already carry the head commit, so its date is read in place 
+    ## instead of asking the commits API once per branch; with stop_at_fresh the records
+    ## come oldest first and reading stops at the first unprotected branch that is not 
+    ## stale, so later pages are never requested.  Returns (records read, stopped early).
+    num_branches = 0
+    num_unprotected = 0
+    branch_records = iter(branch_records)
+    fresh_found = False
+    while not fresh_found:
+        ## a page at a time, so each page's dates are classified in one batch
+        page_records = list(itertools.islice(branch_records, BRANCH_PAGE_SIZE))
+        if not page_records:
+            break
+        ## all dates of the page classified at once, against the scan's cutoff
+        page_stale = age_cutoff.older_than_many(
+            [branch_attributes['commit']['committed_date'] for branch_attributes in page_records])
+        for branch_attributes, date_stale in zip(page_records, page_stale):
+            num_branches += 1
+            branch_stale = check_branch_expiry(
+                project_path, 
+                branch_attributes['name'], 
+                branch_attributes['commit']['committed_date'], 
+                protected_names, 
+                branch_attributes.get('protected', False), 
+                bool(date_stale))
+            if branch_stale is None:
+                continue
+            num_unprotected += 1
+            if stop_at_fresh and not branch_stale:
+                if args.debug: print(f"DEBUG: ordered scan of %r stopped at branch %r" % (project_path, branch_attributes['name']))
+                fresh_found = True
+                break
+    ## the per-branch path listed branches 20 per page (the API default)
+    count_scan_requests(0, num_branches, num_unprotected, -(-num_branches // 20))
+    return num_branches, fresh_found
+
+def scan_branch_page(query_project, project_path, protected_names, page_number):
+    page_branches = query_project.branches.list(page=page_number, per_page=BRANCH_PAGE_SIZE)
+    count_scan_requests(1)
+    scan_branch_records(project_path, (b.attributes for b in page_branches), protected_names)
+
+def branch_list_query():
+    ## --ordered-scan lists branches oldest first (by last commit), so a scan can stop 
+    ## at the first branch newer than the threshold
+    if args.ordered_scan:
+        return {"sort": "updated_asc"}
+    return {}
+
+def scan_project_cached(each_project):
+    ## same scan as scan_project, but every GET goes through the metadata cache so
+    ## unchanged projects cost no requests (fresh) or only 304 responses (revalidated)
+    count_request = lambda: count_scan_requests(1)
+    project_id, project_path = gitlab_cache.cached_project(
+        metadata_cache, gl, getattr(each_project, "id", each_project), count_request)
+    protected_names = {
+        each_rule["name"] 
+        for each_rule in gitlab_cache.cached_list(
+            metadata_cache, gl, "/projects/%d/protected_branches" % (project_id), on_request=count_request)}
+    branch_records = gitlab_cache.cached_list(
+        metadata_cache, gl, "/projects/%d/repository/branches" % (project_id), branch_list_query(), 
+        per_page=BRANCH_PAGE_SIZE, reduce_item=gitlab_cache.reduce_branch, on_request=count_request)
+    scan_branch_records(project_path, branch_records, protected_names, stop_at_fresh=bool(args.ordered_scan))
+
+def scan_project(each_project, split_pages=False):
+    ## returns the project plus any branch page numbers left for the caller to fetch;
+    ## with split_pages=False every page is walked here and the list is empty
     global gl
-    for each_project in input_projects:
-        if args.debug: print(f"DEBUG: query_project = %r" % (each_project))
+    if args.debug: print(f"DEBUG: query_project = %r" % (getattr(each_project, "path_with_namespace", each_project)))
+    if metadata_cache is not None:
+        scan_project_cached(each_project)
+        return None, None, None, []
+    if hasattr(each_project, "path_with_namespace"):
+        ## already described by a group listing, so it does not need to be fetched again
+        query_project = gl.projects.get(each_project.id, lazy=True)
+        project_path = each_project.path_with_namespace
+    else:
         query_project = gl.projects.get(each_project)
-        all_query_project_branches = query_project.branches.list(iterator=True)
-        for each_query_project_branch in all_query_project_branches:
-            current_branch_name = each_query_project_branch.attributes['name']
-            project_protected_branches = query_project.protectedbranches.list()
-            if current_branch_name in PROTECTED_BRANCHES or current_branch_name in project_protected_branches:
-                # print(f"DEBUG: IGNORING %r" % (current_branch_name))
-                pass
-            else:
-                if args.debug: print(f"DEBUG: PROCESSING branch %r" % (current_branch_name))
-                ## NOTE: modifying "(ref_name=current_branch_name" to add ", iterator=True" before ")"
-                ## changes the returned datatype from a list to a RESTAPI object, which breaks the 
-                ## later subscript reference "[0]" to get the first (latest) commit; a pagination error 
-                ## will be produced if more than 20 commits are returned, but can be safely ignored 
-                ## because only the first returned commit is needed
-                all_current_branch_commits = query_project.commits.list(ref_name=current_branch_name, get_all=False)
-                if args.debug: print(f"DEBUG-DEBUG-DEBUG: printing 'all_current_branch_commits'")
-                latest_branch_commit = all_current_branch_commits[0]
-                if args.debug: print(f"DEBUG3: print latest: %r" % (latest_branch_commit))
-                if args.debug: print(f"DEBUG4: LAST COMMIT DATE: %r" % (latest_branch_commit.committed_date))
-                # if date_compare.date_more_than_one_month_ago(latest_branch_commit.committed_date):
-                if date_compare.date_more_than_x_months_ago(latest_branch_commit.committed_date,commit_age_months_threshold):
-                    if args.verbose: print(f"INFO: expiring %r branch %r last updated %r" % (
-                        query_project.path_with_namespace, 
-                        current_branch_name, 
-                        latest_branch_commit.committed_date))
-                    register_branch_to_expire(
-                        query_project.path_with_namespace, 
-                        current_branch_name, 
-                        latest_branch_commit.committed_date)
+        project_path = query_project.path_with_namespace
+        count_scan_requests(1)
+    protected_names = get_protected_branch_names(query_project)
+    if args.ordered_scan:
+        ## pages after the first fresh branch are never requested
+        ordered_branches = query_project.branches.list(iterator=True, per_page=BRANCH_PAGE_SIZE, **branch_list_query())
+        num_read, _ = scan_branch_records(
+            project_path, (b.attributes for b in ordered_branches), protected_names, stop_at_fresh=True)
+        count_scan_requests(1 + max(1, -(-num_read // BRANCH_PAGE_SIZE)))
+        return query_project, project_path, protected_names, []
+    all_query_project_branches = query_project.branches.list(iterator=True, per_page=BRANCH_PAGE_SIZE)
+    count_scan_requests(2)
+    total_pages = all_query_project_branches.total_pages
+    if split_pages and total_pages is not None and total_pages > 1:
+        first_page = itertools.islice(all_query_project_branches, all_query_project_branches.per_page)
+        scan_branch_records(project_path, (b.attributes for b in first_page), protected_names)
+        return query_project, project_path, protected_names, list(range(2, total_pages + 1))
+    if total_pages is not None and total_pages > 1:
+        count_scan_requests(total_pages - 1)
+    scan_branch_records(project_path, (b.attributes for b in all_query_project_branches), protected_names)
+    return query_project, project_path, protected_names, []
+
+def scan_project_mirror(each_project):
+    ## one fetch (clone the first time) plus one for-each-ref per project
+    if hasattr(each_project, "path_with_namespace"):
+        project_path = each_project.path_with_namespace
+    elif str(each_project).isdigit():
+        project_path = get_project_path(each_project)
+        count_scan_requests(1)
+    else:
+        project_path = expand_project_identifier(each_project)
+    if args.debug: print(f"DEBUG: query_project = %r (mirror)" % (project_path))
+    if args.mirror_dir:
+        mirror_dir = args.mirror_dir
+    else:
+        mirror_dir = gitlab_mirror.DEFAULT_MIRROR_DIR
+    if args.mirror_source:
+        source = gitlab_mirror.source_url(args.mirror_source, gitlab_base_url, project_path)
+    else:
+        source = gitlab_mirror.source_url(gitlab_mirror.DEFAULT_SOURCE, gitlab_base_url, project_path)
+    try:
+        mirror, mirror_action = gitlab_mirror.refresh_mirror(mirror_dir, project_path, source, gitlab_access_token)
+        branch_dates = gitlab_mirror.branch_dates(mirror)
+    except gitlab_mirror.MirrorError as e:
+        print(f"ERROR: could not mirror project %r from %r: %s" % (project_path, source, e))
+        return
+    if args.debug: print(f"DEBUG: mirror %r %s (%d branches)" % (str(mirror), mirror_action, len(branch_dates)))
+    ## the default branch is always kept; protection rules come from the API only when 
+    ## mirroring from the GitLab instance itself
+    protected_names = set()
+    mirror_head = gitlab_mirror.default_branch(mirror)
+    if mirror_head:
+        protected_names.add(mirror_head)
+    if not args.mirror_source:
+        try:
+            protected_names |= get_protected_branch_names(gl.projects.get(project_path, lazy=True))
+            count_scan_requests(1)
+        except gitlab.exceptions.GitlabError as e:
+            print(f"WARNING: could not list project %r protected branches: %s" % (project_path, e))
+    scan_branch_records(
+        project_path, 
+        ({"name": branch_name, "commit": {"committed_date": committed_date}} for branch_name, committed_date in branch_dates), 
+        protected_names)
+
+def find_stale_branches_mirror(input_projects):
+    reset_scan_request_counts()
+    if num_workers <= 1:
+        for each_project in input_projects:
+            scan_project_mirror(each_project)
+            scan_request_counts["projects"] += 1
+    else:
+        ## git fetches run in parallel, at most num_workers * 2 projects queued
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as pool:
+            pending_futures = set()
+            for each_project in input_projects:
+                pending_futures.add(pool.submit(scan_project_mirror, each_project))
+                scan_request_counts["projects"] += 1
+                if len(pending_futures) >= num_workers * 2:
+                    done_futures, pending_futures = concurrent.futures.wait(
+                        pending_futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for each_future in done_futures:
+                        each_future.result()
+            for each_future in concurrent.futures.as_completed(pending_futures):
+                each_future.result()
+    sort_expire_plan()
+    report_scan_requests()
+
+def find_stale_branches_graphql(input_projects):
+    reset_scan_request_counts()
+    graphql_endpoint = gitlab_graphql.graphql_endpoint(gitlab_base_url)
+    if args.graphql_batch:
+        batch_size = args.graphql_batch
+    else:
+        batch_size = gitlab_graphql.DEFAULT_BATCH_SIZE
+
+    ## (the first query error; the scan goes on, then fails once it is sorted and counted)
+    scan_errors = []
+
+    def date_batch(project_branches):
+        try:
+            commit_dates = gitlab_graphql.fetch_commit_dates(gl.session, graphql_endpoint, gitlab_access_token, project_branches)
+        except gitlab_graphql.GraphQLError as e:
+            print(f"ERROR: GraphQL commit date query failed for %d branches: %s" % (len(project_branches), e))
+            scan_errors.append(e)
+            commit_dates = []
+        count_scan_requests(1)
+        batch_stale = age_cutoff.older_than_many([committed_date for _, _, committed_date in commit_dates])
+        for (project_path, branch_name, committed_date), date_stale in zip(commit_dates, batch_stale):
+            check_branch_expiry(project_path, branch_name, committed_date, (), date_stale=bool(date_stale))
+
+    ## last-commit dates are queried (batched across projects) as soon as a batch of
+    ## unprotected branches is known, while later project batches are still being listed
+    pool = None
+    date_futures = set()
+    if num_workers > 1:
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=num_workers)
+
+    def dispatch_date_batch(project_branches):
+        if pool is None:
+            date_batch(project_branches)
+            return
+        date_futures.add(pool.submit(date_batch, project_branches))
+        if len(date_futures) >= num_workers * 2:
+            done_futures, _ = concurrent.futures.wait(date_futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for each_future in done_futures:
+                date_futures.discard(each_future)
+                each_future.result()
+
+    branches_to_date = []
+    try:
+        ## branch names and protection rules, batched by project
+        for each_project in gitlab_graphql.fetch_projects(
+                gl.session, graphql_endpoint, gitlab_access_token, 
+                (getattr(p, "id", p) for p in input_projects), batch_size,
+                on_query=lambda: count_scan_requests(1)):
+            if args.debug: print(f"DEBUG: query_project = %r (%d branches)" % (each_project["path"], len(each_project["branches"])))
+            scan_request_counts["projects"] += 1
+            num_unprotected = 0
+            for branch_name in each_project["branches"]:
+                if branch_name in PROTECTED_BRANCHES or gitlab_graphql.is_protected(branch_name, each_project["protected"]):
+                    continue
+                num_unprotected += 1
+                branches_to_date.append((each_project["path"], branch_name))
+                if len(branches_to_date) >= batch_size:
+                    dispatch_date_batch(branches_to_date)
+                    branches_to_date = []
+            num_branches = len(each_project["branches"])
+            count_scan_requests(0, num_branches, num_unprotected, -(-num_branches // 20))
+        if branches_to_date:
+            dispatch_date_batch(branches_to_date)
+    except gitlab_graphql.GraphQLError as e:
+        print(f"ERROR: GraphQL project query failed: %s" % (e))
+        scan_errors.insert(0, e)
+    finally:
+        if pool is not None:
+            for each_future in concurrent.futures.as_completed(date_futures):
+                each_future.result()
+            pool.shutdown()
+    sort_expire_plan()
+    report_scan_requests()
+    ## (a partial plan must not pass for a complete one)
+    if scan_errors:
+        raise scan_errors[0]
+
+def iter_group_projects(target_group, include_subgroups=False):
+    ## yields projects page by page as the group listing is paginated, so scanning 
+    ## can start on the first page while later pages are still to be fetched
+    group_id = get_group_id(target_group)
+    if group_id == 1:
+        return
+    group = gl.groups.get(group_id, lazy=True)
+    ## archived projects are read-only, so their branches cannot be removed
+    for each_project in group.projects.list(
+            iterator=True, per_page=100, include_subgroups=include_subgroups, archived=False):
+        if args.debug: print(f"DEBUG: found group project %r => %r" % (each_project.id, each_project.path_with_namespace))
+        if metadata_cache is not None:
+            metadata_cache.put_project(each_project.id, each_project.id, each_project.path_with_namespace, None)
+        yield each_project
+
+def report_scan_requests():
+    ## compare against the per-branch path: a protected-branch listing for every branch
+    ## plus a commits listing for every unprotected branch
+    projects_scanned = scan_request_counts["projects"]
+    legacy_requests = (
+        projects_scanned 
+        + scan_request_counts["legacy_pages"] 
+        + scan_request_counts["branches"] 
+        + scan_request_counts["unprotected"])
+    print(f"INFO: scanned %d branches in %d projects with %d API requests (per-branch lookups: %d, saved: %d)" % (
+        scan_request_counts["branches"], 
+        projects_scanned, 
+        scan_request_counts["requests"], 
+        legacy_requests, 
+        legacy_requests - scan_request_counts["requests"]))
+
+def find_stale_branches(input_projects):
+    reset_scan_request_counts()
+    if num_workers <= 1:
+        for each_project in input_projects:
+            scan_project(each_project)
+            scan_request_counts["projects"] += 1
+    else:
+        ## projects are scanned concurrently; the remaining branch pages of large projects
+        ## are queued on the same pool so they are spread across all workers
+        ## (project tasks never wait on page tasks, so sharing the pool cannot deadlock)
+        ## projects are pulled from input_projects only as workers free up, so a lazily 
+        ## paginated group listing is scanned as it arrives instead of being collected first
+        if args.debug: print(f"DEBUG: scanning with %d workers" % (num_workers))
+        remaining_projects = iter(input_projects)
+        pending_futures = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as pool:
+            while True:
+                while len(pending_futures) < num_workers * 2:
+                    each_project = next(remaining_projects, None)
+                    if each_project is None:
+                        break
+                    pending_futures[pool.submit(scan_project, each_project, True)] = "project"
+                if not pending_futures:
+                    break
+                done_futures, _ = concurrent.futures.wait(pending_futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for each_future in done_futures:
+                    if pending_futures.pop(each_future) == "project":
+                        query_project, project_path, protected_names, remaining_pages = each_future.result()
+                        scan_request_counts["projects"] += 1
+                        for page_number in remaining_pages:
+                            pending_futures[pool.submit(
+                                scan_branch_page, query_project, project_path, protected_names, page_number)] = "page"
+                    else:
+                        each_future.result()
+    sort_expire_plan()
+    report_scan_requests()
+
+def is_plan_stream(fname):
+    ## plans written while scanning and read back lazily: JSONL or SQLite
+    fext = fname.lower().split(".")[-1]
+    return fext in gitlab_plan.PLAN_STREAM_EXTENSIONS or fext in gitlab_plan.PLAN_DB_EXTENSIONS
+
+def iter_plan_file(fname):
+    ## yields (project, branch, committed_date) sorted by project and branch, also from
+    ## a plan left unsorted by an interrupted scan; a truncated last line is skipped.
+    ## A sorted plan (every plan this script finished writing) is read as is.
+    if plan_stream_sorted:
+        return gitlab_plan.iter_jsonl_records(fname)
+    return gitlab_plan.iter_sorted_jsonl_records(fname)
+
+def iter_plan_projects():
+    ## yields (project, {branch: committed_date}) once per project, sorted, from the 
+    ## lazily read plan file (JSONL or SQLite), or from the in-memory plan
+    if plan_stream_file is None:
+        for project_name in projects_expire_plan:
+            yield project_name, projects_expire_plan[project_name]
+        return
+    if gitlab_plan.is_plan_db(plan_stream_file):
+        plan_db = gitlab_plan.PlanDatabase(plan_stream_file)
+        try:
+            yield from plan_db.iter_projects()
+        finally:
+            plan_db.close()
+        return
+    for project_name, records in itertools.groupby(iter_plan_file(plan_stream_file), key=lambda record: record[0]):
+        yield project_name, {branch_name: committed_date for _, branch_name, committed_date in records}
+
+def count_plan_branches():
+    ## total for the progress counter; unknown (None) for a lazily read JSONL plan
+    if plan_stream_file is not None and gitlab_plan.is_plan_db(plan_stream_file):
+        plan_db = gitlab_plan.PlanDatabase(plan_stream_file)
+        num_branches = plan_db.count()
+        plan_db.close()
+        return num_branches
+    if plan_stream_file is not None:
+        return None
+    return sum(len(projects_expire_plan[each_project]) for each_project in projects_expire_plan)
+
+def read_journal(fname):
+    ## returns the (project, branch) pairs whose last recorded outcome is done; a 
+    ## truncated last line (apply killed mid-write) is ignored
+    last_outcomes = {}
+    try:
+        with open(fname, 'r') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                    last_outcomes[(record["project"], record["branch"])] = record["outcome"]
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    continue
+    except FileNotFoundError:
+        return set()
+    return {each_key for each_key, outcome in last_outcomes.items() if outcome in JOURNAL_DONE_OUTCOMES}
+
+def journal_outcome(project_name, branch_name, outcome):
+    if apply_journal is None:
+        return
+    with journal_lock:
+        apply_journal.write(json.dumps({
+            "project": project_name, 
+            "branch": branch_name, 
+            "outcome": outcome, 
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z")}) + "\n")
+        apply_journal.flush()
+
+def pending_branches(project_name, project_plan):
+    ## plan branches of the project not already done according to the journal
+    return [each_branch for each_branch in project_plan if (project_name, each_branch) not in journal_done]
+
+def stats_phase(name):
+    ## times a phase of the run when --stats is enabled
+    if request_stats is None:
+        return contextlib.nullcontext()
+    return request_stats.phase(name)
+
+def stats_callback():
+    if request_stats is None:
+        return None
+    return request_stats.record
+
+def report_stats():
+    if args.stats_file:
+        stats_file = expand_file_path(args.stats_file)
+        request_stats.write_json(stats_file)
+        print(f"INFO: request statistics written to %r" % (stats_file))
+    else:
+        request_stats.print_table()
 
 def print_branches_to_expire(out_fmt=output_format):
     global projects_expire_plan
-    if out_fmt == "yaml":
-        print(yaml.dump(projects_expire_plan))
+    if plan_stream_file is not None and out_fmt == "yaml":
+        for project_name, project_branches in iter_plan_projects():
+            print(yaml.dump({project_name: project_branches}, Dumper=gitlab_plan.yaml_dumper()), end="")
+        print("")
+    elif plan_stream_file is not None:
+        ## (one JSON object as json.dumps would print it, written a project at a time)
+        separator = "{"
+        for project_name, project_branches in iter_plan_projects():
+            print(separator)
+            print("  %s: %s" % (json.dumps(project_name), json.dumps(project_branches, indent=2).replace("\n", "\n  ")), end="")
+            separator = ","
+        print("{}" if separator == "{" else "\n}")
+    elif out_fmt == "yaml":
+        print(yaml.dump(projects_expire_plan, Dumper=gitlab_plan.yaml_dumper()))
     else:
         print(json.dumps(projects_expire_plan, indent=2))
 
+def print_age_report(out_fmt=output_format):
+    ## branches per age bucket and project: counted during the scan (every unprotected 
+    ## branch), or from the plan file (--infile) read once (only the planned, stale, 
+    ## branches, so the buckets below the plan's threshold stay empty)
+    if branch_age_counts is not None:
+        print(f"INFO: branches by age: every unprotected branch scanned")
+        project_counts = {project_name: branch_age_counts[project_name] for project_name in sorted(branch_age_counts)}
+    else:
+        print(f"INFO: branches by age: only the stale branches planned in %r" % (plan_stream_file or args.infile))
+        project_counts = {
+            project_name: age_buckets.histogram(project_branches.values())["counts"]
+            for project_name, project_branches in iter_plan_projects()}
+    total_counts = [sum(bucket_counts) for bucket_counts in zip(*project_counts.values())] or [0] * len(age_buckets.labels)
+    report = {project_name: dict(zip(age_buckets.labels, counts)) for project_name, counts in project_counts.items()}
+    report["total"] = dict(zip(age_buckets.labels, total_counts))
+    if out_fmt == "yaml":
+        print(yaml.dump(report, Dumper=gitlab_plan.yaml_dumper(), sort_keys=False))
+    else:
+        print(json.dumps(report, indent=2))
+
 def save_plan_file(fname):
     if fname is None:
         print(f"Error: specify a file to save to with \"--outfile\" flag")
@@ -225,17 +770,36 @@ def save_plan_file(fname):
             format = "yaml"
         elif fext in ["json"]:
             format = "json"
+        elif is_plan_stream(fname):
+            format = fext
         else:
             format = output_format
 
     try:
+        if format not in ["yaml", "json"]:
+            ## JSONL/SQLite are written record by record; copy through a temporary file 
+            ## (same extension), so a plan can be saved over the file it is read from
+            temp_fname = os.path.join(os.path.dirname(fname), ".tmp." + os.path.basename(fname))
+            if args.debug: print(f"DEBUG: exporting %s to file" % (format))
+            gitlab_plan.write_plan(temp_fname, (
+                (project_name, branch_name, committed_date)
+                for project_name, project_branches in iter_plan_projects()
+                for branch_name, committed_date in project_branches.items()))
+            os.replace(temp_fname, fname)
+            return
+        if plan_stream_file is not None:
+            plan_data = {}
+            for project_name, project_branches in iter_plan_projects():
+                plan_data.setdefault(project_name, {}).update(project_branches)
+        else:
+            plan_data = projects_expire_plan
         with open(fname, "w") as file:
             if format == "yaml":
                 if args.debug: print(f"DEBUG: exporting yaml to file")
-                yaml.dump(projects_expire_plan, file)
+                yaml.dump(plan_data, file, Dumper=gitlab_plan.yaml_dumper())
             else:
                 if args.debug: print(f"DEBUG: exporting json to file")
-                json.dump(projects_expire_plan, file)
+                json.dump(plan_data, file)
     except PermissionError:
         print(f"Error: Permission denied to write to '{fname}'")
     except IOError as e:
@@ -249,7 +813,7 @@ def read_plan_file(fname):
         with open(fname, 'r') as file:
             if fext in ["yaml", "yml"]:
                 print(f"read yaml")
-                data = yaml.safe_load(file)
+                data = yaml.load(file, Loader=gitlab_plan.yaml_loader())
                 return data
             elif fext in ["json"]:
                 print(f"read json")
@@ -268,133 +832,629 @@ def read_plan_file(fname):
         print(f"An unexpected error occurred: {e}")
         return None
     
+##
+## Steps shared by the threaded (delete_branches) and asyncio (delete_branches_async)
+## deletion engines
+##
+
+def marked_for_deletion_message(project_name, branch_name, branch_commit):
+    return f"INFO: marked for deletion: project %r branch %r\n\tlast update:\t%s\t%r\n\t%s" % (
+        project_name, 
+        branch_name, 
+        branch_commit['committed_date'], 
+        branch_commit['title'],
+        branch_commit['web_url']
+    )
+
+def delete_error_messages(project_name, branch_name, error, api_error=True, permission_hint=False):
+    ## api_error: GitLab refused the deletion (else the request itself failed)
+    if not api_error:
+        return ["ERROR: error removing project %r branch %r - %s" % (project_name, branch_name, error)]
+    messages = [f"ERROR: unable to delete project %r branch %r: %s" % (project_name, branch_name, error)]
+    if permission_hint:
+        messages.append(f"ERROR: verify token/key has correct API write permissions")
+    return messages
+
+def deletion_throughput_counter(limiter=None):
+    if args.action == "apply":
+        counter_label = "deleted branches"
+    else:
+        counter_label = "checked branches"
+    return gitlab_ratelimit.ThroughputCounter(counter_label, count_plan_branches(), limiter=limiter)
+
+def iter_pending_projects(throughput_counter):
+    ## yields (project, [branches to process]) from the plan, leaving out (and counting
+    ## as done) the branches the journal records as done, and projects with none left
+    for project_name, project_plan in iter_plan_projects():
+        project_branches = pending_branches(project_name, project_plan)
+        if len(project_branches) < len(project_plan):
+            print(f"INFO: project %r: skipping %d branches already done (journal)" % (
+                project_name, len(project_plan) - len(project_branches)))
+            throughput_counter.update(len(project_plan) - len(project_branches))
+            if not project_branches:
+                continue
+        print(f"INFO: processing project %r" % (project_name))
+        yield project_name, project_branches
+
+def record_branch_outcome(project_name, branch_name, outcome, throughput_counter):
+    journal_outcome(project_name, branch_name, outcome)
+    throughput_counter.update()
+
+def print_branch_results(project_branches, branch_results):
+    ## prints each branch's messages in plan order; returns [(branch, outcome)]
+    branch_outcomes = []
+    for branch_name, (branch_messages, outcome) in zip(project_branches, branch_results):
+        for each_message in branch_messages:
+            print(each_message)
+        branch_outcomes.append((branch_name, outcome))
+    return branch_outcomes
+
+def finish_project_deletions(project_name, project_id, branch_outcomes, remaining_branches):
+    ## summary, and the cached branch listing of the project is no longer valid
+    summarize_deletions(project_name, branch_outcomes, remaining_branches)
+    if metadata_cache is not None:
+        metadata_cache.drop_pages("/projects/%d/repository/branches" % (project_id))
+
+def expire_branch(project_name, current_project, branch_name, cached_branches=None):
+    ## returns the messages for one branch instead of printing them, so parallel 
+    ## workers can still report in plan order, plus the outcome: "not_found", 
+    ## "checked" (validate), "deleted" (delete accepted, verified later) or "failed"
+    messages = []
+    try:
+        if cached_branches is not None:
+            branch_commit = cached_branches[branch_name]['commit']
+        else:
+            with api_limiter:
+                branch_commit = current_project.branches.get(branch_name).commit
+    except:
+        messages.append(f"WARNING: could not retrieve project %r branch %r" % (project_name, branch_name))
+        return messages, "not_found"
+    messages.append(marked_for_deletion_message(project_name, branch_name, branch_commit))
+    if args.action != "apply":
+        return messages, "checked"
+    # print(f"DEMO: DELETE STAND-IN")
+    try:
+        with api_limiter:
+            current_project.branches.delete(branch_name)
+    except gitlab.exceptions.GitlabDeleteError as e:
+        messages += delete_error_messages(project_name, branch_name, e, permission_hint=True)
+    except Exception as e:
+        messages += delete_error_messages(project_name, branch_name, e, api_error=False)
+    else:
+        ## removal is confirmed for the whole project at once by verify_deletions()
+        return messages, "deleted"
+    return messages, "failed"
+
+def deleted_branch_names(branch_outcomes):
+    return [branch_name for branch_name, outcome in branch_outcomes if outcome == "deleted"]
+
+def verify_by_listing(num_deleted, total_pages):
+    ## whether listing the branches left in the project takes no more requests than a 
+    ## branches.get per deleted branch (total_pages None: over 10000 branches); validate
+    ## with --cache applies the same rule to its planned branches
+    if total_pages is None:
+        total_pages = UNCOUNTED_PAGES
+    return num_deleted >= total_pages
+
+def verify_deletions(project_name, current_project, branch_outcomes):
+    ## returns the deleted branches still present (None if that could not be checked): 
+    ## nothing to do when none were deleted, else one listing of the branches left in the project, or a branches.get per 
+    ## deleted branch when that needs fewer requests than listing every page
+    deleted_branches = deleted_branch_names(branch_outcomes)
+    if not deleted_branches:
+        return set()
+    try:
+        with api_limiter:
+            ## (the first page is fetched here; its headers give the page count)
+            branch_listing = current_project.branches.list(iterator=True, per_page=BRANCH_PAGE_SIZE)
+        if verify_by_listing(len(deleted_branches), branch_listing.total_pages):
+            with api_limiter:
+                remaining_branches = {each_branch.attributes['name'] for each_branch in branch_listing}
+        else:
+            remaining_branches = {
+                branch_name for branch_name in deleted_branches 
+                if branch_still_present(current_project, branch_name)}
+    except gitlab.exceptions.GitlabError as e:
+        print(f"WARNING: could not list project %r branches to verify deletions: %s" % (project_name, e))
+        remaining_branches = None
+    return remaining_branches
+
+def branch_still_present(current_project, branch_name):
+    try:
+        with api_limiter:
+            current_project.branches.get(branch_name)
+    except gitlab.exceptions.GitlabGetError as e:
+        if e.response_code == 404:
+            return False
+        raise
+    return True
+
+def summarize_deletions(project_name, branch_outcomes, remaining_branches):
+    ## prints a single summary for the project (remaining_branches is None when the 
+    ## project could not be listed)
+    global plan_branches_not_found, plan_branches_not_deleted
+    removed, still_present, failed, not_found, unverified = [], [], [], [], []
+    for branch_name, outcome in branch_outcomes:
+        if outcome == "not_found":
+            not_found.append(branch_name)
+        elif outcome == "failed":
+            failed.append(branch_name)
+        elif remaining_branches is None:
+            unverified.append(branch_name)
+        elif branch_name in remaining_branches:
+            still_present.append(branch_name)
+        else:
+            removed.append(branch_name)
+
+    for branch_name in removed:
+        if args.verbose: print(f"INFO: deletion SUCCESSFUL: project %r branch %r removed" % (project_name, branch_name))
+    for branch_name in still_present:
+        print(f"WARNING: project %r branch %r NOT removed" % (project_name, branch_name))
+        journal_outcome(project_name, branch_name, "still_present")
+    if not_found:
+        plan_branches_not_found[project_name] = not_found
+    if still_present or failed:
+        plan_branches_not_deleted[project_name] = still_present + failed
+    summary = "INFO: project %r: %d removed, %d still present, %d failed, %d not found" % (
+        project_name, len(removed), len(still_present), len(failed), len(not_found))
+    if unverified:
+        summary += ", %d unverified" % (len(unverified))
+    print(summary)
+
+async def scan_project_async(client, each_project):
+    ## async twin of scan_project: same requests, issued over the pooled client
+    if hasattr(each_project, "path_with_namespace"):
+        project_id, project_path = each_project.id, each_project.path_with_namespace
+    else:
+        project = await client.get_json("/projects/%s" % (gitlab_async.quote_path(each_project)))
+        project_id, project_path = project["id"], project["path_with_namespace"]
+    if args.debug: print(f"DEBUG: query_project = %r" % (project_path))
+    if args.ordered_scan:
+        ## one page at a time, oldest first, until the first fresh branch
+        protected_rules = await client.list_all("/projects/%d/protected_branches" % (project_id))
+        protected_names = {each_rule["name"] for each_rule in protected_rules}
+        async for page_records in client.iter_pages(
+                "/projects/%d/repository/branches" % (project_id), branch_list_query(), per_page=BRANCH_PAGE_SIZE):
+            _, fresh_found = scan_branch_records(project_path, page_records, protected_names, stop_at_fresh=True)
+            if fresh_found:
+                break
+        return
+    protected_rules, branch_records = await asyncio.gather(
+        client.list_all("/projects/%d/protected_branches" % (project_id)),
+        client.list_all("/projects/%d/repository/branches" % (project_id), per_page=BRANCH_PAGE_SIZE))
+    scan_branch_records(project_path, branch_records, {each_rule["name"] for each_rule in protected_rules})
+
+async def find_stale_branches_async(input_projects):
+    reset_scan_request_counts()
+    ## input_projects may be a lazily paginated group listing (blocking python-gitlab
+    ## calls), so the next project is pulled in a thread, one puller at a time
+    remaining_projects = iter(input_projects)
+    pull_lock = asyncio.Lock()
+    loop = asyncio.get_running_loop()
+
+    async def project_worker(client):
+        while True:
+            async with pull_lock:
+                each_project = await loop.run_in_executor(None, next, remaining_projects, None)
+            if each_project is None:
+                return
+            await scan_project_async(client, each_project)
+            scan_request_counts["projects"] += 1
+
+    async with gitlab_async.AsyncGitLab(gitlab_base_url, gitlab_access_token, num_async_requests, stats_callback()) as client:
+        if args.debug: print(f"DEBUG: async scan with %d requests in flight (http2: %r)" % (client.concurrency, client.http2))
+        await asyncio.gather(*(project_worker(client) for _ in range(client.concurrency)))
+        scan_request_counts["requests"] += client.request_count
+    sort_expire_plan()
+    report_scan_requests()
+
+async def expire_branch_async(client, project_name, project_id, branch_name):
+    ## async twin of expire_branch: returns (messages, outcome)
+    branch_path = "/projects/%d/repository/branches/%s" % (project_id, gitlab_async.quote_path(branch_name))
+    messages = []
+    try:
+        branch_commit = (await client.get_json(branch_path))['commit']
+    except Exception:
+        messages.append(f"WARNING: could not retrieve project %r branch %r" % (project_name, branch_name))
+        return messages, "not_found"
+    messages.append(marked_for_deletion_message(project_name, branch_name, branch_commit))
+    if args.action != "apply":
+        return messages, "checked"
+    try:
+        await client.delete(branch_path)
+    except gitlab_async.AsyncGitLabError as e:
+        messages += delete_error_messages(project_name, branch_name, e, permission_hint=e.response_code in (401, 403))
+    except Exception as e:
+        messages += delete_error_messages(project_name, branch_name, e, api_error=False)
+    else:
+        return messages, "deleted"
+    return messages, "failed"
+
+async def verify_deletions_async(client, project_name, project_id, branch_outcomes):
+    ## async twin of verify_deletions
+    deleted_branches = deleted_branch_names(branch_outcomes)
+    if not deleted_branches:
+        return set()
+    branches_path = "/projects/%d/repository/branches" % (project_id)
+    try:
+        response = await client.first_page(branches_path, per_page=BRANCH_PAGE_SIZE)
+        total_pages = response.headers.get("X-Total-Pages")
+        if verify_by_listing(len(deleted_branches), int(total_pages) if total_pages else None):
+            remaining_branches = {
+                each_branch["name"] 
+                for each_branch in await client.list_all(branches_path, per_page=BRANCH_PAGE_SIZE, response=response)}
+        else:
+            branches_present = await asyncio.gather(*(
+                branch_still_present_async(client, project_id, branch_name) for branch_name in deleted_branches))
+            remaining_branches = {
+                branch_name for branch_name, present in zip(deleted_branches, branches_present) if present}
+    except gitlab_async.AsyncGitLabError as e:
+        print(f"WARNING: could not list project %r branches to verify deletions: %s" % (project_name, e))
+        remaining_branches = None
+    return remaining_branches
+
+async def branch_still_present_async(client, project_id, branch_name):
+    try:
+        await client.get_json("/projects/%d/repository/branches/%s" % (project_id, gitlab_async.quote_path(branch_name)))
+    except gitlab_async.AsyncGitLabError as e:
+        if e.response_code == 404:
+            return False
+        raise
+    return True
+
+async def delete_branches_async():
+    throughput_counter = deletion_throughput_counter()
+    async with gitlab_async.AsyncGitLab(gitlab_base_url, gitlab_access_token, num_async_requests, stats_callback()) as client:
+        for project_name, project_branches in iter_pending_projects(throughput_counter):
+            project_id = (await client.get_json("/projects/%s" % (gitlab_async.quote_path(project_name))))["id"]
+
+            async def expire_and_count(branch_name):
+                branch_messages, outcome = await expire_branch_async(client, project_name, project_id, branch_name)
+                record_branch_outcome(project_name, branch_name, outcome, throughput_counter)
+                return branch_messages, outcome
+
+            branch_results = await asyncio.gather(*(expire_and_count(branch_name) for branch_name in project_branches))
+            branch_outcomes = print_branch_results(project_branches, branch_results)
+            if args.action == "apply":
+                remaining_branches = await verify_deletions_async(client, project_name, project_id, branch_outcomes)
+                finish_project_deletions(project_name, project_id, branch_outcomes, remaining_branches)
+    throughput_counter.finish()
+
 def delete_branches():
     global projects_expire_plan
-    for project_name in projects_expire_plan:
-        print(f"INFO: processing project %r" % (project_name))
-        current_project = gl.projects.get(project_name)
-        project_branches = projects_expire_plan.get(project_name)
-        for branch_name in project_branches:
-            try:
-                branch_instance = current_project.branches.get(branch_name)
-            except:
-                print(f"WARNING: could not retrieve project %r branch %r" % (project_name, branch_name))
-            else:
-                print(f"INFO: marked for deletion: project %r branch %r\n\tlast update:\t%s\t%r\n\t%s" % (
-                    project_name, 
-                    branch_name, 
-                    branch_instance.commit['committed_date'], 
-                    branch_instance.commit['title'],
-                    branch_instance.commit['web_url']
-                ))
-                if args.action == "apply":
-                    # print(f"DEMO: DELETE STAND-IN")
-                    try:
-                        current_project.branches.delete(branch_name)
-                    except gitlab.exceptions.GitlabDeleteError as e:
-                        print(f"ERROR: unable to delete project %r branch %r: %s" % (project_name, branch_name, e))
-                        print(f"ERROR: verify token/key has correct API write permissions")
-                    except Exception as e:
-                        print("ERROR: error removing project %r branch %r - %s" % (project_name, branch_name, e))
-                    else:
-                        try:
-                            deleted_branch = current_project.branches.get(branch_name)
-                        except gitlab.exceptions.GitlabGetError as e:
-                            ## indicates 404: 404 Branch Not Found
-                            print(f"INFO: deletion SUCCESSFUL: project %r branch %r removed" % (project_name, branch_name))
-                        except gitlab.exceptions.GitlabHttpError as e:
-                            print(f"INFO: project %r branch %r could not be retrieved: %s" %(project_name, branch_name, e))
-                        else:
-                            print(f"WARNING: project %r branch %r NOT removed" % (project_name, branch_name))
+    throughput_counter = deletion_throughput_counter(limiter=api_limiter)
+    for project_name, project_branches in iter_pending_projects(throughput_counter):
+        cached_branches = None
+        if metadata_cache is not None:
+            project_id, project_path = gitlab_cache.cached_project(metadata_cache, gl, project_name)
+            current_project = gl.projects.get(project_id, lazy=True)
+            branch_list_path = "/projects/%d/repository/branches" % (project_id)
+            if args.action == "validate" and verify_by_listing(len(project_branches), 
+                    gitlab_cache.cached_page_count(metadata_cache, branch_list_path, per_page=BRANCH_PAGE_SIZE)):
+                ## validation only displays branch details, so the cached listing is good 
+                ## enough, when it takes no more pages than a branches.get per planned branch
+                cached_branches = {
+                    each_branch["name"]: each_branch 
+                    for each_branch in gitlab_cache.cached_list(
+                        metadata_cache, gl, branch_list_path, 
+                        per_page=BRANCH_PAGE_SIZE, reduce_item=gitlab_cache.reduce_branch)}
+        else:
+            current_project = gl.projects.get(project_name)
 
+        def expire_and_count(branch_name):
+            messages, outcome = expire_branch(project_name, current_project, branch_name, cached_branches)
+            record_branch_outcome(project_name, branch_name, outcome, throughput_counter)
+            return messages, outcome
+
+        if num_workers <= 1:
+            branch_results = map(expire_and_count, project_branches)
+            pool = None
+        else:
+            ## bounded pool per project; the adaptive limiter shrinks the number of 
+            ## requests in flight when GitLab answers 429 and grows it back afterwards
+            pool = concurrent.futures.ThreadPoolExecutor(max_workers=num_workers)
+            branch_results = pool.map(expire_and_count, project_branches)
+        branch_outcomes = print_branch_results(project_branches, branch_results)
+        if pool is not None:
+            pool.shutdown()
+        if args.action == "apply":
+            remaining_branches = verify_deletions(project_name, current_project, branch_outcomes)
+            finish_project_deletions(project_name, current_project.get_id(), branch_outcomes, remaining_branches)
+    throughput_counter.finish()
 
 
-## 
-## MAIN
-## 
 
-## Set access token
-##     In decreasing preference: 
-##         CLI token file arg  >  CI_JOB_TOKEN env var  >  default token file
-if args.tokenpath:
-    access_token_file_path = args.tokenpath
-    gitlab_access_token = get_token(access_token_file_path)
-else:
-    access_token_file_path = PRIVATE_TOKEN_FILE
+##
+## LIBRARY API - also used by main() below
+##
+
+def resolve_token(tokenpath=None, required=True):
+    ## In decreasing preference:
+    ##     CLI token file arg  >  CI_JOB_TOKEN env var  >  default token file
+    if tokenpath:
+        return get_token(tokenpath)
     try:
-        CI_JOB_TOKEN = os.environ["CI_JOB_TOKEN"]
+        return os.environ["CI_JOB_TOKEN"]
     except:
         try:
-            gitlab_access_token = get_token(access_token_file_path)
+            return get_token(PRIVATE_TOKEN_FILE)
         except:
+            if not required:
+                return None
             print("ERROR: could not read token")
             sys.exit(1)
-        else:
-            # print(f"DEBUG: Found token: '{gitlab_access_token}'")
-            pass
-    else:
-        gitlab_access_token = CI_JOB_TOKEN
 
-    
-## Set output format (yaml or json)
-## 
-if args.format:
-    if args.debug: print(f"DEBUG: args.format = %r" % (args.format))
-    if args.format.lower() in ["yaml", "json"]:
-        output_format = args.format.lower()
+def connect(url=None, token=None, workers=None, backend=None, cache_file=None, cache_ttl=None, stats=False, auth=True):
+    ## builds the authenticated client and everything that shares it (rate limiter,
+    ## metadata cache, request statistics); returns the gitlab.Gitlab object (auth=False
+    ## skips the authentication request, for offline git-mirror scans)
+    global gitlab_base_url, gitlab_access_token, gl, request_stats, api_limiter, num_workers
+    global scan_backend, num_async_requests, metadata_cache
+    if url:
+        gitlab_base_url = url.rstrip("/")
+    if token is None:
+        token = resolve_token()
+    gitlab_access_token = token
+    gl = gitlab.Gitlab(url=gitlab_base_url, private_token=gitlab_access_token)
+    # gl.enable_debug()
+
+    ## Record every API request
+    if stats:
+        request_stats = gitlab_stats.RequestStats()
+        gl.session.hooks["response"].append(request_stats.response_hook)
+
+    if auth:
+        with stats_phase("auth"):
+            gl.auth()
+
+    ## Set number of concurrent workers used to scan and delete branches, and the
+    ## limiter that adapts how many of their requests are in flight to GitLab's rate limits
+    if workers:
+        num_workers = workers
     else:
-        print(f"Specified output format %r not recognized: use 'yaml' or 'json'" % args.format.lower())
-        sys.exit(2)
+        num_workers = DEFAULT_WORKERS
+    api_limiter = gitlab_ratelimit.AdaptiveLimiter(num_workers)
+    gl.session.hooks["response"].append(api_limiter.response_hook)
 
-## Instantiate a Gitlab object
-## 
-gl = gitlab.Gitlab(url=GITLAB_BASE_URL, private_token=gitlab_access_token)
-# gl.enable_debug()
-gl.auth()
-
-
-if args.infile:
-    input_file = expand_file_path(args.infile)
-    projects_expire_plan = read_plan_file(input_file)
-else:
-    ## Set projects to check for branches that should be expired/removed
-    if args.project:
-        if args.debug: print(f"DEBUG: found project argument(s): %r" % (args.project))
-        for each_project in args.project:
-            if args.debug: print(f"DEBUG: looking up project ID for %r" % each_project)
-            all_projects.add(get_project_id(each_project))
+    ## Set API used to scan branches (rest, graphql or async); the async backend also
+    ## deletes branches, with --workers requests in flight over one pooled client
+    if backend:
+        scan_backend = backend
+    else:
+        scan_backend = DEFAULT_BACKEND
+    if workers:
+        num_async_requests = workers
     else:
-        if args.debug: print(f"DEBUG: did NOT find project argument(s); checking default project list")
-        for each_project in DEFAULT_GL_PROJECTS:
-            if args.debug: print(f"DEBUG: looking up project ID for %r" % each_project)
-            all_projects.add(get_project_id(each_project))
+        num_async_requests = gitlab_async.DEFAULT_CONCURRENCY
+
+    ## Open the metadata cache (project ids/paths, branch listings); ":memory:" keeps
+    ## it for the life of the process only
+    if cache_file:
+        if cache_ttl is None:
+            cache_ttl = gitlab_cache.DEFAULT_TTL
+        metadata_cache = gitlab_cache.MetadataCache(cache_file, cache_ttl)
+    return gl
+
+def plan_branches(projects=None, groups=None, include_subgroups=False, months=None):
+    ## scans projects (ids or paths) and all projects of groups with the connected
+    ## client; returns the plan {project path: {branch: last commit date}}
+    global all_projects, projects_expire_plan, commit_age_months_threshold, age_cutoff
+    all_projects = set()
+    projects_expire_plan = {}
+
+    ## Set projects to check for branches that should be expired/removed (the 
+    ## git-mirror backend works from project paths, looking up only numeric ids)
+    with stats_phase("resolve"):
+        if scan_backend == "git-mirror" and (projects or not groups):
+            all_projects.update(projects or DEFAULT_GL_PROJECTS)
+        elif projects:
+            if args.debug: print(f"DEBUG: found project argument(s): %r" % (projects))
+            for each_project in projects:
+                if args.debug: print(f"DEBUG: looking up project ID for %r" % each_project)
+                all_projects.add(get_project_id(each_project))
+        elif not groups:
+            if args.debug: print(f"DEBUG: did NOT find project argument(s); checking default project list")
+            for each_project in DEFAULT_GL_PROJECTS:
+                if args.debug: print(f"DEBUG: looking up project ID for %r" % each_project)
+                all_projects.add(get_project_id(each_project))
 
     if args.debug: print(f"DEBUG: current value of 'all_projects':")
     print(all_projects)
 
+    ## Group projects are streamed to the scanner page by page (never collected in a set)
+    input_projects = all_projects
+    if groups:
+        if args.debug: print(f"DEBUG: found group argument(s): %r" % (groups))
+        input_projects = itertools.chain(
+            all_projects,
+            *(iter_group_projects(each_group, include_subgroups) for each_group in groups))
+
     ## Set commit age (months) to use as threshold for expiring/removing branches
-    if args.months:
-        commit_age_months_threshold = args.months
+    if months:
+        commit_age_months_threshold = months
     else:
         commit_age_months_threshold = DEFAULT_COMMIT_AGE_MONTHS_THRESHOLD
+    ## (one cutoff for the whole scan, so it does not drift while a long scan runs)
+    age_cutoff = date_compare.AgeCutoff(commit_age_months_threshold)
+
+    ## (group projects are listed while scanning, so that time counts as scan time)
+    with stats_phase("scan"):
+        if scan_backend == "graphql":
+            find_stale_branches_graphql(input_projects)
+        elif scan_backend == "async":
+            asyncio.run(find_stale_branches_async(input_projects))
+        elif scan_backend == "git-mirror":
+            find_stale_branches_mirror(input_projects)
+        else:
+            find_stale_branches(input_projects)
+    return projects_expire_plan
 
-    find_stale_branches(all_projects)
 
-if args.outfile:
-    output_file = expand_file_path(args.outfile)
-    save_plan_file(output_file)
+##
+## MAIN
+##
+
+def main(argv=None):
+    global args, output_format, projects_expire_plan, plan_stream, plan_stream_file, plan_stream_sorted, plan_filename
+    global journal_done, apply_journal, age_buckets, branch_age_counts
+    ## Read arguments from command line
+    args = parser.parse_args(argv)
+
+    ## Set output format (yaml or json)
+    ##
+    if args.format:
+        if args.debug: print(f"DEBUG: args.format = %r" % (args.format))
+        if args.format.lower() in ["yaml", "json"]:
+            output_format = args.format.lower()
+        else:
+            print(f"Specified output format %r not recognized: use 'yaml' or 'json'" % args.format.lower())
+            sys.exit(2)
+
+    ## Connect; the serve action keeps its metadata in memory unless --cache is given
+    ##
+    cache_file = args.cache
+    ## (only the rest backend reads projects and branch listings through the cache,
+    ## and serve rescans on the warm cache)
+    if (cache_file or args.action == "serve") and (args.backend or DEFAULT_BACKEND) != "rest":
+        print(f"ERROR: %s needs the rest backend, not %r" % ("serve" if args.action == "serve" else "--cache", args.backend or DEFAULT_BACKEND))
+        sys.exit(2)
+    if args.action == "serve" and not cache_file:
+        cache_file = ":memory:"
+    ## (an offline git-mirror plan from --mirror-source needs no token or API access)
+    offline_mirror = args.backend == "git-mirror" and bool(args.mirror_source) and args.action == "plan" and not args.group
+    ## Set age buckets for the report action
+    ##
+    if args.action == "report":
+        try:
+            bucket_months = [int(each_months) for each_months in args.age_buckets.split(",")] if args.age_buckets else date_compare.DEFAULT_AGE_BUCKETS
+            age_buckets = date_compare.AgeBuckets(bucket_months)
+        except ValueError:
+            print(f"ERROR: age buckets %r not recognized: use positive months, e.g. 1,3,6,12" % (args.age_buckets))
+            sys.exit(2)
+        if not args.infile:
+            ## (counted while scanning: every unprotected branch, so no early stop)
+            branch_age_counts = {}
+            if args.ordered_scan:
+                print(f"WARNING: --ordered-scan ignored by report (all branches are counted)")
+                args.ordered_scan = False
+
+    ## (printing a plan or report read from a file needs no connection at all)
+    if not (args.action in ["plan", "report"] and args.infile):
+        connect(
+            url=args.url,
+            token=resolve_token(args.tokenpath, required=not offline_mirror),
+            workers=args.workers,
+            backend=args.backend,
+            cache_file=cache_file,
+            cache_ttl=args.cache_ttl,
+            stats=bool(args.stats or args.stats_file),
+            auth=not offline_mirror)
+    ## (statistics are reported at exit, also after an error or interrupt)
+    if request_stats is not None:
+        atexit.register(report_stats)
+
+    if args.action == "serve":
+        ## Rescan on a schedule with the warm client/cache, serving the latest plan
+        gitlab_serve.serve(
+            lambda: plan_branches(args.project, args.group, args.include_subgroups, args.months),
+            args.listen or gitlab_serve.DEFAULT_LISTEN,
+            args.interval or gitlab_serve.DEFAULT_INTERVAL)
+        return
 
+    if args.infile:
+        input_file = expand_file_path(args.infile)
+        if is_plan_stream(input_file):
+            if not os.path.isfile(input_file):
+                print(f"Error: File not found: {input_file}")
+                sys.exit(5)
+            plan_stream_file = input_file
+            plan_stream_sorted = gitlab_plan.is_plan_db(input_file) or gitlab_plan.is_sorted_jsonl_plan(input_file)
+        else:
+            projects_expire_plan = read_plan_file(input_file)
+    else:
+        ## A JSONL/SQLite outfile is written while scanning, one branch at a time
+        if args.outfile and is_plan_stream(expand_file_path(args.outfile)):
+            plan_filename = expand_file_path(args.outfile)
+            if gitlab_plan.is_plan_db(plan_filename):
+                plan_stream = gitlab_plan.PlanDatabase(plan_filename, "w")
+            else:
+                plan_stream = open(plan_filename, "w")
+
+        try:
+            plan_branches(args.project, args.group, args.include_subgroups, args.months)
+        except gitlab_graphql.GraphQLError:
+            ## (the scan is incomplete: no plan is saved, and a streamed one is removed)
+            if plan_stream is not None:
+                plan_stream.close()
+                os.remove(plan_filename)
+            print(f"ERROR: scan failed, no plan saved")
+            sys.exit(1)
+
+        if plan_stream is not None:
+            plan_stream.close()
+            plan_stream = None
+            plan_stream_file = plan_filename
+            ## (JSONL lines are in the order branches were found, which concurrent 
+            ## scans interleave; SQLite plans are read back sorted anyway)
+            if not gitlab_plan.is_plan_db(plan_filename):
+                gitlab_plan.sort_jsonl_plan(plan_filename)
+            plan_stream_sorted = True
+
+    if args.outfile and plan_filename is None:
+        output_file = expand_file_path(args.outfile)
+        save_plan_file(output_file)
+
+
+    print("")
+
+    if args.action == "plan":
+        if args.debug: print(f"DEBUG: plan steps")
+        print_branches_to_expire(output_format)
+    elif args.action == "report":
+        if args.debug: print(f"DEBUG: report steps")
+        print_age_report(output_format)
+    # elif args.action == "apply":
+    elif args.action in ["validate", "apply"]:
+        if args.debug: print(f"DEBUG: apply steps")
+        print(f"INFO: Deleting branches per plan:")
+        print_branches_to_expire(output_format)
+        ## Journal each apply outcome as it happens (next to the plan file by default),
+        ## so an interrupted purge can be rerun with --resume
+        if args.journal:
+            journal_file = expand_file_path(args.journal)
+        elif args.infile or args.outfile:
+            journal_file = expand_file_path(args.infile or args.outfile) + JOURNAL_SUFFIX
+        else:
+            journal_file = None
+        if args.resume:
+            if journal_file is None:
+                print(f"ERROR: --resume needs a journal: use \"--journal\" or a plan file (\"--infile\")")
+                sys.exit(2)
+            journal_done = read_journal(journal_file)
+            print(f"INFO: resuming from journal %r: %d branches already done" % (journal_file, len(journal_done)))
+        if args.action == "apply" and journal_file is not None:
+            apply_journal = open(journal_file, "a")
+        with stats_phase(args.action):
+            if scan_backend == "async":
+                asyncio.run(delete_branches_async())
+            else:
+                delete_branches()
+        if apply_journal is not None:
+            apply_journal.close()
+    else:
+        print(f"ERROR: unrecognized action %r" % (args.action))
 
-print("")
+    if metadata_cache is not None:
+        if args.verbose: print(f"INFO: metadata cache %r: %d fresh, %d revalidated, %d fetched" % (
+            str(metadata_cache.filepath),
+            metadata_cache.counts["fresh"],
+            metadata_cache.counts["revalidated"],
+            metadata_cache.counts["fetched"]))
+        metadata_cache.close()
+    if args.verbose:
+        parse_stats = date_compare.parse_cache_stats()
+        print(f"INFO: date parse cache: %d hits, %d misses, %d evictions (%d/%d entries)" % (
+            parse_stats["hits"], parse_stats["misses"], parse_stats["evictions"], parse_stats["size"], parse_stats["maxsize"]))
 
-if args.action == "plan":
-    if args.debug: print(f"DEBUG: plan steps")
-    print_branches_to_expire(output_format)
-# elif args.action == "apply":
-elif args.action in ["validate", "apply"]:
-    if args.debug: print(f"DEBUG: apply steps")
-    print(f"INFO: Deleting branches per plan:")
-    print_branches_to_expire(output_format)
-    delete_branches()
-else:
-    print(f"ERROR: unrecognized action %r" % (args.action))
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 """Parse a pipe-delimited table, store headers and values, and reformat output."""
 
+import os
 import sys
+import mmap
+import locale
 import argparse
 
 args = argparse.ArgumentParser(description='Parse a pipe-delimited table, store headers and values, and reformat output.')
@@ -14,27 +17,15 @@ args.add_argument('--delimiter', type=str, help='The delimiter to use')
 args.add_argument('--row_delimiter', type=str, help='The row delimiter to use')
 args.add_argument('--column_delimiter', type=str, help='The column delimiter to use')
 args.add_argument('--column_spacing', type=str, help='The column spacing to use')
+args.add_argument('--stream', action='store_true', help='Read the file in two passes over a memory map and write rows as they are formatted (constant memory; needs a file)')
 
 args = args.parse_args()
 
-def parse_table(lines):
+def iter_table_rows(lines):
     """
-    Parse a table with format:
-    +-----+---------+------+
-    | col1 | col2   | col3 |
-    +-----+---------+------+
-    | val1 | val2   | val3 |
-    +-----+---------+------+
-
-    Returns:
-        headers: 2D list of header rows (to support multi-line headers)
-        values: 2D list of data rows
-        max_data_lengths: dict mapping column index to max string length in DATA only
+    Yield (in_header, cells) for each header and data row of a table, skipping
+    blank and separator lines. Rows before the second separator are header rows.
     """
-    headers = []      # 2D list: list of header rows, each row is a list of cells
-    values = []       # 2D list: list of data rows, each row is a list of cells
-    max_data_lengths = {}
-
     separator_count = 0
     in_header = True
 
@@ -54,24 +45,86 @@ def parse_table(lines):
 
         # Parse data row
         parts = line.split('|')
-        cells = [cell.strip() for cell in parts[1:-1]]
+        yield in_header, [cell.strip() for cell in parts[1:-1]]
+
 
+def update_max_lengths(max_data_lengths, cells):
+    """Track max lengths only for DATA cells (not headers)."""
+    for col_idx, cell in enumerate(cells):
+        cell_len = len(cell)
+        if col_idx not in max_data_lengths:
+            max_data_lengths[col_idx] = cell_len
+        else:
+            max_data_lengths[col_idx] = max(max_data_lengths[col_idx], cell_len)
+
+
+def parse_table(lines):
+    """
+    Parse a table with format:
+    +-----+---------+------+
+    | col1 | col2   | col3 |
+    +-----+---------+------+
+    | val1 | val2   | val3 |
+    +-----+---------+------+
+
+    Returns:
+        headers: 2D list of header rows (to support multi-line headers)
+        values: 2D list of data rows
+        max_data_lengths: dict mapping column index to max string length in DATA only
+    """
+    headers = []      # 2D list: list of header rows, each row is a list of cells
+    values = []       # 2D list: list of data rows, each row is a list of cells
+    max_data_lengths = {}
+
+    for in_header, cells in iter_table_rows(lines):
         # Store in appropriate structure
         if in_header:
             headers.append(cells)
         else:
             values.append(cells)
-            # Track max lengths only for DATA cells (not headers)
-            for col_idx, cell in enumerate(cells):
-                cell_len = len(cell)
-                if col_idx not in max_data_lengths:
-                    max_data_lengths[col_idx] = cell_len
-                else:
-                    max_data_lengths[col_idx] = max(max_data_lengths[col_idx], cell_len)
+            update_max_lengths(max_data_lengths, cells)
 
     return headers, values, max_data_lengths
 
 
+def scan_table(lines):
+    """
+    First pass of the streaming mode: like parse_table, but data rows are only
+    measured, not kept.
+
+    Returns:
+        headers: 2D list of header rows
+        num_values: number of data rows
+        max_data_lengths: dict mapping column index to max string length in DATA only
+    """
+    headers = []
+    num_values = 0
+    max_data_lengths = {}
+
+    for in_header, cells in iter_table_rows(lines):
+        if in_header:
+            headers.append(cells)
+        else:
+            num_values += 1
+            update_max_lengths(max_data_lengths, cells)
+
+    return headers, num_values, max_data_lengths
+
+
+def iter_data_rows(lines):
+    """Second pass of the streaming mode: yield the data rows only."""
+    for in_header, cells in iter_table_rows(lines):
+        if not in_header:
+            yield cells
+
+
+def iter_mapped_lines(mapped_file, encoding):
+    """Yield the decoded lines of a memory-mapped file, from its start."""
+    mapped_file.seek(0)
+    for line in iter(mapped_file.readline, b''):
+        yield line.decode(encoding)
+
+
 def wrap_header_words(header_text, max_width):
     """
     Wrap a header into multiple lines if it has multiple words and exceeds max_width.
@@ -172,18 +225,25 @@ def compute_wrapped_headers(headers, max_data_lengths):
 
 def format_table(headers, values, max_lengths, num_cols=None):
     """
-    Format headers and values into a table with:
+    Format headers and values into a table (see iter_table_lines) as one string.
+    """
+    return '\n'.join(iter_table_lines(headers, values, max_lengths, num_cols))
+
+
+def iter_table_lines(headers, values, max_lengths, num_cols=None):
+    """
+    Yield the lines of headers and values formatted into a table with:
     - One space between separator and content
     - Headers centered in each column
     - Values left-aligned in each column
 
     Args:
+        values: Data rows; any iterable, read once (rows are formatted as they come).
         num_cols: Number of columns to output (from left). If None, outputs all columns.
     """
     total_cols = len(max_lengths)
     if num_cols is None or num_cols > total_cols:
         num_cols = total_cols
-    output_lines = []
 
     # Build separator line
     sep_parts = ['+']
@@ -194,7 +254,7 @@ def format_table(headers, values, max_lengths, num_cols=None):
     separator = ''.join(sep_parts)
 
     # Add top separator
-    output_lines.append(separator)
+    yield separator
 
     # Format header rows (centered)
     for header_row in headers:
@@ -205,14 +265,16 @@ def format_table(headers, values, max_lengths, num_cols=None):
             centered = cell.center(max_lengths[col_idx])
             row_parts.append(f' {centered} ')
             row_parts.append('|')
-        output_lines.append(''.join(row_parts))
+        yield ''.join(row_parts)
 
     # Add separator after headers
     if headers:
-        output_lines.append(separator)
+        yield separator
 
     # Format value rows (right-aligned)
+    has_values = False
     for value_row in values:
+        has_values = True
         row_parts = ['|']
         for col_idx in range(num_cols):
             cell = value_row[col_idx] if col_idx < len(value_row) else ''
@@ -220,16 +282,55 @@ def format_table(headers, values, max_lengths, num_cols=None):
             padded = cell.rjust(max_lengths[col_idx])
             row_parts.append(f' {padded} ')
             row_parts.append('|')
-        output_lines.append(''.join(row_parts))
+        yield ''.join(row_parts)
 
     # Add bottom separator
-    if values:
-        output_lines.append(separator)
+    if has_values:
+        yield separator
+
 
-    return '\n'.join(output_lines)
+def stream_table(filename):
+    """
+    Reformat a table file in two passes over a memory map: the first measures the
+    columns and wraps the headers, the second writes each formatted row to stdout.
+    Only the headers and column widths are kept in memory.
+    """
+    encoding = locale.getpreferredencoding(False)
+    with open(filename, 'rb') as f:
+        # An empty file cannot be mapped
+        if os.fstat(f.fileno()).st_size == 0:
+            mapped_file = None
+            headers, num_values, max_data_lengths = scan_table([])
+        else:
+            mapped_file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            headers, num_values, max_data_lengths = scan_table(iter_mapped_lines(mapped_file, encoding))
+        try:
+            wrapped_headers, final_widths = compute_wrapped_headers(headers, max_data_lengths)
+
+            if args.debug:
+                print("=== Parsed Data ===")
+                print(f"Original Headers: {headers}")
+                print(f"Wrapped Headers: {wrapped_headers}")
+                print(f"Values: {num_values} rows (streamed)")
+                print(f"Max data lengths: {max_data_lengths}")
+                print(f"Final widths: {final_widths}")
+                print()
+                print("=== Reformatted Table ===")
+            values = iter_data_rows(iter_mapped_lines(mapped_file, encoding)) if mapped_file is not None else []
+            sys.stdout.writelines(line + '\n' for line in iter_table_lines(wrapped_headers, values, final_widths, args.columns))
+        finally:
+            if mapped_file is not None:
+                mapped_file.close()
 
 
 def main():
+    if args.stream:
+        if not args.file:
+            print("Error: --stream needs a file (stdin cannot be read twice)", file=sys.stderr)
+            sys.exit(2)
+        stream_table(args.file)
+        return
+
     # Read from file if provided, otherwise stdin
     if args.file:
         with open(args.file, 'r') as f: